@@ -1,6 +1,7 @@
 from fastapi import FastAPI, HTTPException
 from pydantic import BaseModel
 from typing import List, Optional
+import asyncio
 import json
 from datetime import datetime
 import uuid
@@ -12,31 +13,46 @@ from schemas import *
 
 app = FastAPI()
 
+# Held from load to save by every endpoint that changes the metadata file, so
+# concurrent requests cannot overwrite each other's changes while the disk
+# access runs on a worker thread
+metadata_lock = asyncio.Lock()
+loop_monitor = LoopLagMonitor()
+
+@app.on_event("startup")
+async def start_loop_monitor():
+    loop_monitor.start()
+
+## Event loop lag, to confirm no handler blocks the loop
+@app.get("/metrics")
+async def metrics():
+    return {"event_loop_lag": loop_monitor.stats()}
+
 # CRUD API Endpoints
 ## Register Broker
 @app.post("/register_broker/")
 async def register_broker(broker: BrokerRecord):
     filePath = "./metadata-8000.json"
-    data = load_data(filePath)
-    foundDict = checkBrokerExists(broker.dict(),data["RegisterBrokerRecords"]["records"])
-    if(foundDict):
-        return foundDict['internal_uuid']
-    timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    data["RegisterBrokerRecords"]['timestamp'] = timestamp
-    serverSetup = broker.dict()
-    serverSetup["internal_uuid"] = str(uuid.uuid4())
-    serverSetup["brokerStatus"] = "ALIVE"
-    serverSetup["epoch"] = 0
-    data["RegisterBrokerRecords"]["records"].append(serverSetup)
-    save_data(filePath,data)
-    return serverSetup["internal_uuid"]
+    async with metadata_lock:
+        data = await load_data_async(filePath)
+        foundDict = checkBrokerExists(broker.dict(),data["RegisterBrokerRecords"]["records"])
+        if(foundDict):
+            return foundDict['internal_uuid']
+        mark_changed(data, "RegisterBrokerRecords")
+        serverSetup = broker.dict()
+        serverSetup["internal_uuid"] = str(uuid.uuid4())
+        serverSetup["brokerStatus"] = "ALIVE"
+        serverSetup["epoch"] = 0
+        data["RegisterBrokerRecords"]["records"].append(serverSetup)
+        await save_data_async(filePath,data)
+        return serverSetup["internal_uuid"]
 
 
 ## Get all brokers
 @app.get("/get_broker/")
 async def get_allbrokers():
     filePath = "./metadata-8000.json"
-    data = load_data(filePath)
+    data = await load_data_async(filePath)
     return data["RegisterBrokerRecords"]["records"]
 
 
@@ -44,7 +60,7 @@ async def get_allbrokers():
 @app.get("/get_broker/{broker_id}")
 async def get_broker_by_ID(broker_id:int):
     filePath = "./metadata-8000.json"
-    data = load_data(filePath)
+    data = await load_data_async(filePath)
     found_dict = next((broker for broker in data["RegisterBrokerRecords"]["records"] if broker.get("brokerId") == broker_id), None)
     if found_dict:
         return found_dict
@@ -54,38 +70,38 @@ async def get_broker_by_ID(broker_id:int):
 @app.delete("/delete_broker/{broker_id}")
 async def delete_broker(broker_id: int):
     filePath = "./metadata-8000.json"
-    data = load_data(filePath)
-    brokers = data["RegisterBrokerRecords"]["records"]
-    index = next((index for index, broker in enumerate(brokers) if broker.get("brokerId") == broker_id), None)
-    deletedBroker = None
-    if index is not None:
-        deletedBroker = brokers.pop(index)
-    data["RegisterBrokerRecords"]["records"] = brokers
-    timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    data["RegisterBrokerRecords"]["timestamp"] = timestamp
-    save_data(filePath,data)
-    return deletedBroker if deletedBroker is not None else "Broker Not Found"
+    async with metadata_lock:
+        data = await load_data_async(filePath)
+        brokers = data["RegisterBrokerRecords"]["records"]
+        index = next((index for index, broker in enumerate(brokers) if broker.get("brokerId") == broker_id), None)
+        deletedBroker = None
+        if index is not None:
+            deletedBroker = brokers.pop(index)
+        data["RegisterBrokerRecords"]["records"] = brokers
+        mark_changed(data, "RegisterBrokerRecords")
+        await save_data_async(filePath,data)
+        return deletedBroker if deletedBroker is not None else "Broker Not Found"
 
 ## Register Topic
 @app.post("/register_topic/")
 async def register_topic(topicRecord:TopicRecord):
     filePath = "./metadata-8000.json"
-    data = load_data(filePath)
-    found_dict = next((topic for topic in data["TopicRecord"]["records"] if topic.get("name") == topicRecord.name), None)
-    if(found_dict):
-        return found_dict['topicUUID']
-    serverSetup = {"name":topicRecord.name,"topicUUID":str(uuid.uuid4())}
-    data["TopicRecord"]["records"].append(serverSetup)
-    timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    data["TopicRecord"]["timestamp"] = timestamp
-    save_data(filePath,data)
-    return serverSetup["topicUUID"]
+    async with metadata_lock:
+        data = await load_data_async(filePath)
+        found_dict = next((topic for topic in data["TopicRecord"]["records"] if topic.get("name") == topicRecord.name), None)
+        if(found_dict):
+            return found_dict['topicUUID']
+        serverSetup = {"name":topicRecord.name,"topicUUID":str(uuid.uuid4())}
+        data["TopicRecord"]["records"].append(serverSetup)
+        mark_changed(data, "TopicRecord")
+        await save_data_async(filePath,data)
+        return serverSetup["topicUUID"]
 
 ## Get Topic by topic name
 @app.get("/get_topic/{topicName}")
 async def getTopicByName(topicName:str):
     filePath = "./metadata-8000.json"
-    data = load_data(filePath)
+    data = await load_data_async(filePath)
     found_dict = next((topic for topic in data["TopicRecord"]["records"] if topic.get("name") == topicName), None)
     if(found_dict):
         return found_dict
@@ -95,45 +111,45 @@ async def getTopicByName(topicName:str):
 @app.get("/get_topic/")
 async def getAllTopics():
     filePath = "./metadata-8000.json"
-    data = load_data(filePath)
+    data = await load_data_async(filePath)
     return data["TopicRecord"]["records"]
 
 ## Delete topic by topic name
 @app.delete("/delete_topic/{topicName}")
 async def delete_topicByName(topicName: str):
     filePath = "./metadata-8000.json"
-    data = load_data(filePath)
-    topics = data["TopicRecord"]["records"]
-    index = next((index for index, topic in enumerate(topics) if topic.get("name") == topicName), None)
-    deletedTopic = None
-    if index is not None:
-        deletedTopic = topics.pop(index)
-    data["TopicRecord"]["records"] = topics
-    timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    data["TopicRecord"]["timestamp"] = timestamp
-    save_data(filePath,data)
-    return deletedTopic if deletedTopic is not None else "Topic Not Found"
+    async with metadata_lock:
+        data = await load_data_async(filePath)
+        topics = data["TopicRecord"]["records"]
+        index = next((index for index, topic in enumerate(topics) if topic.get("name") == topicName), None)
+        deletedTopic = None
+        if index is not None:
+            deletedTopic = topics.pop(index)
+        data["TopicRecord"]["records"] = topics
+        mark_changed(data, "TopicRecord")
+        await save_data_async(filePath,data)
+        return deletedTopic if deletedTopic is not None else "Topic Not Found"
 
 ## Register a partition
 @app.post("/register_partition/")
 async def register_partition(partitionRecord:PartitionRecord):
     filePath = "./metadata-8000.json"
-    data = load_data(filePath)
-    found_dict = next((partition for partition in data["PartitionRecord"]["records"] if partition.get("partitionId") == partitionRecord.partitionId), None)
-    if(found_dict):
-        return found_dict['partitionId']
-    serverSetup = partitionRecord.dict()
-    data["PartitionRecord"]["records"].append(serverSetup)
-    timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    data["PartitionRecord"]["timestamp"] = timestamp
-    save_data(filePath,data)
-    return serverSetup["topicUUID"]
+    async with metadata_lock:
+        data = await load_data_async(filePath)
+        found_dict = next((partition for partition in data["PartitionRecord"]["records"] if partition.get("partitionId") == partitionRecord.partitionId), None)
+        if(found_dict):
+            return found_dict['partitionId']
+        serverSetup = partitionRecord.dict()
+        data["PartitionRecord"]["records"].append(serverSetup)
+        mark_changed(data, "PartitionRecord")
+        await save_data_async(filePath,data)
+        return serverSetup["topicUUID"]
 
 ## Get partition by prtitionId
 @app.get("/get_partition/{partitionId}")
 async def get_partitionByID(partitionId:int):
     filePath = "./metadata-8000.json"
-    data = load_data(filePath)
+    data = await load_data_async(filePath)
     found_dict = next((partition for partition in data["PartitionRecord"]["records"] if partition.get("partitionId") == partitionId), None)
     if(found_dict):
         return found_dict
@@ -143,53 +159,55 @@ async def get_partitionByID(partitionId:int):
 @app.get("/get_partition/")
 async def get_allpartitions():
     filePath = "./metadata-8000.json"
-    data = load_data(filePath)
+    data = await load_data_async(filePath)
     return data["PartitionRecord"]["records"]
 
 ## Delete a partition by partitionId
 @app.delete("/delete_partition/{partition_id}")
 async def delete_partition(partition_id: int):
     filePath = "./metadata-8000.json"
-    data = load_data(filePath)
-    partitions = data["PartitionRecord"]["records"]
-    index = next((index for index, partition in enumerate(partitions) if partition.get("partitionId") == partition_id), None)
-    deletedPartition = None
-    if index is not None:
-        deletedPartition = partitions.pop(index)
-    data["PartitionRecord"]["records"] = partitions
-    timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    data["PartitionRecord"]["timestamp"] = timestamp
-    save_data(filePath,data)
-    return deletedPartition if deletedPartition is not None else "Partition Not Found"
+    async with metadata_lock:
+        data = await load_data_async(filePath)
+        partitions = data["PartitionRecord"]["records"]
+        index = next((index for index, partition in enumerate(partitions) if partition.get("partitionId") == partition_id), None)
+        deletedPartition = None
+        if index is not None:
+            deletedPartition = partitions.pop(index)
+        data["PartitionRecord"]["records"] = partitions
+        mark_changed(data, "PartitionRecord")
+        await save_data_async(filePath,data)
+        return deletedPartition if deletedPartition is not None else "Partition Not Found"
 
 # Broker Management API Endpoints
 ## Register Broker Changes
 @app.post("/register_broker_change/")
 async def register_broker_change(brokerChange:BrokerChangeRecord):
-    brokerChange = brokerChange.dict()
-    filePath = "./metadata-8000.json"
-    data = load_data(filePath)
-    brokers = data["RegisterBrokerRecords"]["records"]
-
-    for index,broker in enumerate(brokers):
-        if(broker["brokerId"]==brokerChange["brokerId"]):
-            brokers[index] = {**broker,**brokerChange}
-            brokers[index]["epoch"] += 1
-            timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            data["RegisterBrokerRecords"]["timestamp"] = timestamp
-            data["RegistrationChangeBrokerRecord"]["timestamp"] = timestamp
+    async with metadata_lock:
+        brokerChange = brokerChange.dict()
+        filePath = "./metadata-8000.json"
+        data = await load_data_async(filePath)
+        brokers = data["RegisterBrokerRecords"]["records"]
+
+        for index,broker in enumerate(brokers):
+            if(broker["brokerId"]==brokerChange["brokerId"]):
+                brokers[index] = {**broker,**brokerChange}
+                brokers[index]["epoch"] += 1
+                mark_changed(data, "RegisterBrokerRecords", "RegistrationChangeBrokerRecord")
         
-            data["RegisterBrokerRecords"]["records"] = brokers
-            data["RegistrationChangeBrokerRecord"]["records"].append(brokerChange)
-            save_data(filePath,data)
-            return "Changes Updated Successfully"
-    return "Broker Not Found"
+                data["RegisterBrokerRecords"]["records"] = brokers
+                data["RegistrationChangeBrokerRecord"]["records"].append(brokerChange)
+                await save_data_async(filePath,data)
+                return "Changes Updated Successfully"
+        return "Broker Not Found"
     
-## Fetch Changes from last timestamp
+## Fetch Changes after the last version
 @app.post("/metadata_fetch/")
-async def metadata_fetch():
-    # Logic for metadata fetch
-    pass
+async def metadata_fetch(fetchRequest: MetadataFetchRequest):
+    filePath = "./metadata-8000.json"
+    data = await load_data_async(filePath)
+    returnData = {section: data[section] for section in data if data[section].get("version", 0) > fetchRequest.version}
+    returnData["version"] = max([fetchRequest.version] + [data[section].get("version", 0) for section in data])
+    return returnData
 
 
 
@@ -200,26 +218,26 @@ async def metadata_fetch():
 @app.post("/register_producer/")
 async def register_producer(producerRecord: ProducerIdsRecord):
     filePath = "./metadata-8000.json"
-    data = load_data(filePath)
-    foundDict = checkProducerExists(producerRecord.dict(),data["ProducerIdsRecord"]["records"])
-    if(foundDict):
-        return foundDict['producerId']
-    serverSetup = producerRecord.dict()
-    found_dict = next((producer for producer in data["RegisterBrokerRecords"]["records"] if producer.get("internal_uuid") == serverSetup['brokerId']), None)
-    if found_dict:
-        serverSetup["brokerEpoch"] = found_dict["epoch"]
-        data["ProducerIdsRecord"]["records"].append(serverSetup)
-        timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        data["ProducerIdsRecord"]['timestamp'] = timestamp
-        save_data(filePath,data)
-        return "Producer Registered Successfully"
-    return "Broker Not Recognised"
+    async with metadata_lock:
+        data = await load_data_async(filePath)
+        foundDict = checkProducerExists(producerRecord.dict(),data["ProducerIdsRecord"]["records"])
+        if(foundDict):
+            return foundDict['producerId']
+        serverSetup = producerRecord.dict()
+        found_dict = next((producer for producer in data["RegisterBrokerRecords"]["records"] if producer.get("internal_uuid") == serverSetup['brokerId']), None)
+        if found_dict:
+            serverSetup["brokerEpoch"] = found_dict["epoch"]
+            data["ProducerIdsRecord"]["records"].append(serverSetup)
+            mark_changed(data, "ProducerIdsRecord")
+            await save_data_async(filePath,data)
+            return "Producer Registered Successfully"
+        return "Broker Not Recognised"
 
 ## Get producer by searchParams -> {partitionId:int, brokerId: str"uuid"}
 @app.post("/get_producer/")
 async def get_producer(searchParam:SearchParam):
     filePath = "./metadata-8000.json"
-    data = load_data(filePath)
+    data = await load_data_async(filePath)
     foundDict = checkProducerExists(searchParam.dict(),data["ProducerIdsRecord"]["records"])
     if(foundDict):
         return foundDict
@@ -229,7 +247,7 @@ async def get_producer(searchParam:SearchParam):
 @app.get("/get_producer/")
 async def get_producers():
     filePath = "./metadata-8000.json"
-    data = load_data(filePath)
+    data = await load_data_async(filePath)
     return data["ProducerIdsRecord"]["records"]
 
 
@@ -238,7 +256,7 @@ async def get_producers():
 @app.get("/metadata_fetch_client/")
 async def metadata_fetch_client():
     filePath = "./metadata-8000.json"
-    data = load_data(filePath)
+    data = await load_data_async(filePath)
     returnData = {}
     returnData["RegisterBrokerRecords"] = data["RegisterBrokerRecords"]
     returnData["TopicRecord"] = data["TopicRecord"]
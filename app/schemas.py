@@ -34,6 +34,10 @@ class ProducerIdsRecord(BaseModel):
     brokerEpoch: int
     producerId: int
 
+class MetadataFetchRequest(BaseModel):
+    # Highest version returned by the previous fetch; -1 fetches every section
+    version: int = -1
+
 class SearchParam(BaseModel):
     brokerId: str
     producerId: int
\ No newline at end of file
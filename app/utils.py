@@ -1,5 +1,9 @@
 # Utility functions to handle data storage and retrieval
+import asyncio
+import collections
 import json
+import os
+from datetime import datetime
 
 
 def load_data(path):
@@ -33,8 +37,28 @@ def load_data(path):
         return data
 
 def save_data(path,data):
-    with open(path, 'w') as file:
+    # Write a temporary file and rename it over the old one, so a concurrent
+    # load_data sees either the old or the new content, never a partial file
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w') as file:
         json.dump(data, file, indent=2)
+    os.replace(tmp_path, path)
+
+async def load_data_async(path):
+    # Disk access runs on a worker thread so it never stalls the event loop
+    return await asyncio.get_running_loop().run_in_executor(None, load_data, path)
+
+async def save_data_async(path,data):
+    await asyncio.get_running_loop().run_in_executor(None, save_data, path, data)
+
+def mark_changed(data, *sections):
+    # Every write takes the next version of the whole file, so the highest version
+    # is a cursor that metadata_fetch callers can pass back to get only later changes
+    version = max(data[section].get("version", 0) for section in data) + 1
+    timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    for section in sections:
+        data[section]["timestamp"] = timestamp
+        data[section]["version"] = version
 
 def checkBrokerExists(brokerData,data):
     found_dict = next((broker for broker in data if broker.get("brokerId") == brokerData['brokerId']), None)
@@ -42,4 +66,51 @@ def checkBrokerExists(brokerData,data):
 
 def checkProducerExists(brokerData,data):
     found_dict = next((broker for broker in data if broker.get("producerId") == brokerData['producerId'] and broker.get("brokerId")==brokerData["brokerId"]), None)
-    return found_dict
\ No newline at end of file
+    return found_dict
+
+class LoopLagMonitor:
+    """
+    Measures event loop lag: how much later than scheduled the loop wakes a task
+    sleeping at a fixed interval. Blocking work on the loop, such as synchronous
+    disk access in an async handler, shows up directly as lag.
+    """
+
+    def __init__(self, interval=0.1, window=600):
+        """
+        Args:
+            interval (float): Seconds between samples.
+            window (int): Number of recent samples kept for the statistics.
+        """
+        self.interval = interval
+        self.samples = collections.deque(maxlen=window)
+        self.task = None
+
+    def start(self):
+        """
+        Start sampling. Must run on the event loop being measured.
+        """
+        if self.task is None:
+            self.task = asyncio.ensure_future(self.run())
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            expected = loop.time() + self.interval
+            await asyncio.sleep(self.interval)
+            self.samples.append(max(0.0, loop.time() - expected))
+
+    def stats(self):
+        """
+        Returns:
+            dict: Sample count and last, mean, p99 and max lag in milliseconds over the window.
+        """
+        samples = sorted(self.samples)
+        if not samples:
+            return {"samples": 0}
+        return {
+            "samples": len(samples),
+            "last_ms": round(self.samples[-1] * 1000, 3),
+            "mean_ms": round(sum(samples) / len(samples) * 1000, 3),
+            "p99_ms": round(samples[int(len(samples) * 0.99)] * 1000, 3),
+            "max_ms": round(samples[-1] * 1000, 3),
+        }
@@ -0,0 +1,97 @@
+import collections
+import random
+import threading
+from datetime import datetime
+
+from segment_log import FSYNC_NEVER, SegmentLog
+
+
+class AuditLogger:
+    """
+    Node-local audit trail of API invocations and cluster events.
+
+    Recording an event only appends it to an in-memory ring buffer, so request
+    handlers never touch the disk. A background thread drains the buffer in
+    batches into a segmented log, whose oldest segments are deleted once it
+    outgrows its size limit. Each event can be sampled at its own rate, so
+    frequent events like reads and heartbeats do not crowd out the rest.
+    The audit trail is not replicated; every node keeps its own.
+    """
+
+    def __init__(self, directory, sample_rates=None, default_rate=1.0, buffer_size=10000,
+                 flush_interval=1.0, flush_batch=1000, segment_bytes=16 * 1024 * 1024, retention_bytes=64 * 1024 * 1024):
+        """
+        Args:
+            directory (str): Directory holding the audit log segments.
+            sample_rates (dict, optional): Fraction of events to keep, by endpoint for
+                "api_invocation" events and by event type for the others.
+            default_rate (float): Fraction kept of events without a rate of their own.
+            buffer_size (int): Events held in memory; the oldest are dropped when it overflows.
+            flush_interval (float): Seconds between flushes of the buffer.
+            flush_batch (int): Buffered events that trigger a flush before the interval is up.
+            segment_bytes (int): Size after which the audit log starts a new segment.
+            retention_bytes (int): Upper bound on the on-disk size of the audit log.
+        """
+        self.log = SegmentLog(directory, segment_bytes=segment_bytes, fsync_policy=FSYNC_NEVER)
+        self.sample_rates = sample_rates or {}
+        self.default_rate = default_rate
+        self.buffer = collections.deque(maxlen=buffer_size)
+        self.flush_interval = flush_interval
+        self.flush_batch = flush_batch
+        self.retention_bytes = retention_bytes
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.dropped = 0
+        self.written = 0
+        threading.Thread(target=self.flush_loop, daemon=True).start()
+
+    def record(self, event_type, details):
+        """
+        Buffer an event, subject to its sampling rate. Safe to call from any thread.
+
+        Args:
+            event_type (str): The type of event (e.g., 'api_invocation', 'heartbeat_sent').
+            details (dict): Detailed information about the event.
+        """
+        key = details.get("endpoint", event_type) if event_type == "api_invocation" else event_type
+        rate = self.sample_rates.get(key, self.default_rate)
+        if rate < 1 and random.random() >= rate:
+            return
+        event = {"timestamp": datetime.now().isoformat(), "event_type": event_type, "details": details}
+        if rate < 1:
+            # Lets readers scale sampled counts back up
+            event["sample_rate"] = rate
+        with self.lock:
+            if len(self.buffer) == self.buffer.maxlen:
+                self.dropped += 1
+            self.buffer.append(event)
+            if len(self.buffer) >= self.flush_batch:
+                self.wakeup.set()
+
+    def flush_loop(self):
+        while True:
+            self.wakeup.wait(self.flush_interval)
+            self.wakeup.clear()
+            try:
+                self.flush()
+            except OSError as error:
+                print(f"Failed to write the audit log: {error!r}")
+
+    def flush(self):
+        """
+        Write every buffered event to the audit log with one append, then enforce the size limit.
+        """
+        with self.lock:
+            events = list(self.buffer)
+            self.buffer.clear()
+        if events:
+            self.log.append_many(events)
+            self.written += len(events)
+            self.log.enforce_retention(self.retention_bytes)
+
+    def stats(self):
+        """
+        Returns:
+            dict: Events waiting in the buffer, dropped on overflow and written so far.
+        """
+        return {"buffered": len(self.buffer), "dropped": self.dropped, "written": self.written}
@@ -0,0 +1,459 @@
+"""
+Micro-benchmarks for the Raft node.
+
+Usage:
+    python bench.py rpc [count]
+    python bench.py commit [seconds]
+    python bench.py failover [rounds]
+    python bench.py partition [seconds]
+    python bench.py transfer [rounds]
+    python bench.py store [records]
+"""
+import json
+import os
+import shutil
+import signal
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+
+import httpx
+from fastapi import FastAPI
+
+from metadata_store import *
+from rpc import PeerPool
+
+BENCH_PORT = 8999
+NODE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "node.py")
+CLUSTER_PORTS = (9001, 9002, 9003)
+WINDOWS = (0, 0.002, 0.005)
+
+
+def start_echo_server(port=BENCH_PORT):
+    """
+    Start a minimal FastAPI server in a background thread and wait until it accepts requests.
+
+    Args:
+        port (int): The port to listen on.
+    """
+    import uvicorn
+
+    echo = FastAPI()
+
+    @echo.post("/heartbeat")
+    def heartbeat(payload: dict):
+        return {"message": "Acknowledged"}
+
+    server = uvicorn.Server(uvicorn.Config(echo, host="127.0.0.1", port=port, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+    return server
+
+
+def start_cluster(directory, config, ports=CLUSTER_PORTS):
+    """
+    Start one node process per port in a scratch directory, the first as leader, and wait until all serve requests.
+
+    Args:
+        directory (str): Working directory holding config.json and the node files.
+        config (dict): Settings merged into the initial config.json.
+        ports (tuple): Node ports; the first one becomes the leader.
+
+    Returns:
+        list: The node processes.
+    """
+    with open(os.path.join(directory, "config.json"), "w") as file:
+        json.dump({"leader_node": None, "follower_nodes": [], **config}, file)
+    processes = [start_node(directory, port) for port in ports]
+    # Let the leader start replicating to every follower
+    time.sleep(1)
+    return processes
+
+
+def start_node(directory, port):
+    """
+    Start one node process and wait until it serves requests.
+
+    Args:
+        directory (str): Working directory holding config.json and the node files.
+        port (int): The node's port.
+
+    Returns:
+        subprocess.Popen: The node process.
+    """
+    process = subprocess.Popen([sys.executable, NODE, str(port)], cwd=directory, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    while True:
+        try:
+            httpx.get(f"http://localhost:{port}/status", timeout=1)
+            return process
+        except httpx.HTTPError:
+            time.sleep(0.1)
+
+
+def node_status(port):
+    """
+    Returns:
+        dict: The node's /status, or None if it does not answer.
+    """
+    try:
+        return httpx.get(f"http://localhost:{port}/status", timeout=0.2).json()
+    except httpx.HTTPError:
+        return None
+
+
+def stop_cluster(processes):
+    for process in processes:
+        process.terminate()
+    for process in processes:
+        process.wait()
+
+
+def report(name, samples, elapsed=None):
+    samples = sorted(samples)
+    throughput = f"  {len(samples) / elapsed:8.0f} req/s" if elapsed else ""
+    print(
+        f"{name:<24} mean {statistics.mean(samples) * 1000:7.3f} ms"
+        f"  p50 {samples[len(samples) // 2] * 1000:7.3f} ms"
+        f"  p99 {samples[int(len(samples) * 0.99)] * 1000:7.3f} ms"
+        f"{throughput}"
+    )
+
+
+def bench_rpc(count=2000):
+    """
+    Compare per-RPC latency of a fresh connection per call against the pooled keep-alive client.
+
+    Args:
+        count (int): Number of heartbeat RPCs per variant.
+    """
+    start_echo_server()
+    payload = {"term": 0, "entries": []}
+
+    samples = []
+    for _ in range(count):
+        started = time.perf_counter()
+        # One client per call, as the node did with bare requests.post
+        with httpx.Client() as client:
+            client.post(f"http://localhost:{BENCH_PORT}/heartbeat", json=payload)
+        samples.append(time.perf_counter() - started)
+    report("new connection per RPC", samples)
+
+    peers = PeerPool()
+    samples = []
+    for _ in range(count):
+        started = time.perf_counter()
+        peers.get(BENCH_PORT).post("/heartbeat", json=payload)
+        samples.append(time.perf_counter() - started)
+    report("pooled keep-alive", samples)
+    peers.close()
+
+
+def drive_writes(port, concurrency, duration):
+    """
+    Register topics from concurrent clients for a fixed time.
+
+    Each client is a thread with its own keep-alive connection, which loads the
+    node far more evenly than one asyncio client pool.
+
+    Args:
+        port (int): The leader's port.
+        concurrency (int): Number of clients, each with one request in flight.
+        duration (float): Seconds to keep writing.
+
+    Returns:
+        list: The latency of every completed request.
+    """
+    samples = []
+    deadline = time.perf_counter() + duration
+
+    def writer(worker):
+        with httpx.Client(base_url=f"http://localhost:{port}", timeout=30) as client:
+            sequence = 0
+            while time.perf_counter() < deadline:
+                started = time.perf_counter()
+                client.post("/register_topic/", json={"name": f"bench-{concurrency}-{worker}-{sequence}"})
+                samples.append(time.perf_counter() - started)
+                sequence += 1
+
+    writers = [threading.Thread(target=writer, args=(worker,)) for worker in range(concurrency)]
+    for thread in writers:
+        thread.start()
+    for thread in writers:
+        thread.join()
+    return samples
+
+
+def bench_commit(duration=3.0):
+    """
+    Measure write throughput against latency on a local 3-node cluster, for several
+    group commit windows and client concurrency levels.
+
+    Args:
+        duration (float): Seconds of writes per concurrency level.
+    """
+    for window in WINDOWS:
+        directory = tempfile.mkdtemp(prefix="raft-bench-")
+        processes = start_cluster(directory, {"group_commit_window": window, "fsync_policy": "always"})
+        try:
+            for concurrency in (1, 4, 16, 64):
+                started = time.perf_counter()
+                samples = drive_writes(CLUSTER_PORTS[0], concurrency, duration)
+                report(f"window {window * 1000:g} ms x{concurrency}", samples, time.perf_counter() - started)
+        finally:
+            stop_cluster(processes)
+            shutil.rmtree(directory, ignore_errors=True)
+
+
+def bench_failover(rounds=10):
+    """
+    Measure how long a local 3-node cluster is without a leader after the leader crashes.
+
+    Each round kills the leader process, polls the other nodes until one leads a
+    later term, times the first write that commits through it, and then restarts
+    the killed node, which rejoins as a follower.
+
+    Args:
+        rounds (int): Number of leader crashes.
+    """
+    directory = tempfile.mkdtemp(prefix="raft-bench-")
+    processes = dict(zip(CLUSTER_PORTS, start_cluster(directory, {})))
+    elected = []
+    writable = []
+    try:
+        for round_number in range(rounds):
+            statuses = [node_status(port) for port in CLUSTER_PORTS]
+            leader = next(status for status in statuses if status and status["role"] == "leader")
+            processes[leader["port"]].kill()
+            processes[leader["port"]].wait()
+            started = time.perf_counter()
+            new_leader = None
+            while new_leader is None:
+                for port in CLUSTER_PORTS:
+                    status = node_status(port) if port != leader["port"] else None
+                    if status and status["role"] == "leader" and status["term"] > leader["term"]:
+                        new_leader = status
+                        break
+                else:
+                    time.sleep(0.005)
+            elected.append(time.perf_counter() - started)
+            while not isinstance(
+                httpx.post(f"http://localhost:{new_leader['port']}/register_topic/", json={"name": f"failover-{round_number}"}, timeout=5).json(), str
+            ):
+                time.sleep(0.005)
+            writable.append(time.perf_counter() - started)
+            print(f"round {round_number}: leader {leader['port']} -> {new_leader['port']} in term {new_leader['term']}")
+            processes[leader["port"]] = start_node(directory, leader["port"])
+            # Let the restarted node catch up before the next crash
+            time.sleep(1)
+        report("new leader elected", elected)
+        report("first write committed", writable)
+    finally:
+        stop_cluster(processes.values())
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def write_to_leader(leader, completed, done, worker):
+    """
+    Register topics at the node leader["port"] names until done is set.
+
+    Args:
+        leader (dict): "port" of the current leader, kept up to date by the caller.
+        completed (list): Gets the time at which each committed write returned.
+        done (threading.Event): Set to stop writing.
+        worker (int): Distinguishes this writer's topic names.
+    """
+    sequence = 0
+    while not done.is_set():
+        try:
+            response = httpx.post(
+                f"http://localhost:{leader['port']}/register_topic/", json={"name": f"chaos-{worker}-{sequence}"}, timeout=5
+            ).json()
+        except httpx.HTTPError:
+            response = None
+        if isinstance(response, str):
+            completed.append(time.perf_counter())
+        else:
+            time.sleep(0.01)
+        sequence += 1
+
+
+def longest_gap(completed, start, end):
+    """
+    Returns:
+        float: The longest time between start, the writes completed up to end, and end, in seconds.
+    """
+    times = [start] + sorted(at for at in list(completed) if start <= at < end) + [end]
+    return max(later - earlier for earlier, later in zip(times, times[1:]))
+
+
+def bench_partition(pause=3.0, concurrency=4):
+    """
+    Chaos test: cut one follower off from a local 3-node cluster and let it rejoin.
+
+    The follower is frozen with SIGSTOP, so it neither sends nor answers RPCs, for
+    pause seconds; when it resumes its election timer has long run out. Writers
+    follow the leader throughout. The run reports write throughput before, during
+    and after the partition and every leader change, once with pre-vote off and
+    once with it on.
+
+    Args:
+        pause (float): Seconds the follower is cut off.
+        concurrency (int): Number of writers.
+    """
+    phases = (("before", 3.0), ("partitioned", pause), ("after", 3.0))
+    for pre_vote in (False, True):
+        directory = tempfile.mkdtemp(prefix="raft-bench-")
+        processes = start_cluster(directory, {"pre_vote": pre_vote})
+        victim = processes[-1]
+        leader = {"port": CLUSTER_PORTS[0]}
+        # (term, port) of every leader seen
+        leaders = {(0, CLUSTER_PORTS[0])}
+        completed = []
+        done = threading.Event()
+
+        def watch():
+            while not done.is_set():
+                for port in CLUSTER_PORTS[:-1]:
+                    status = node_status(port)
+                    if status and status["role"] == "leader":
+                        leaders.add((status["term"], port))
+                        leader["port"] = port
+                time.sleep(0.05)
+
+        threads = [threading.Thread(target=watch)] + [
+            threading.Thread(target=write_to_leader, args=(leader, completed, done, worker)) for worker in range(concurrency)
+        ]
+        try:
+            for thread in threads:
+                thread.start()
+            boundaries = [time.perf_counter()]
+            for name, seconds in phases:
+                if name == "partitioned":
+                    victim.send_signal(signal.SIGSTOP)
+                time.sleep(seconds)
+                if name == "partitioned":
+                    victim.send_signal(signal.SIGCONT)
+                boundaries.append(time.perf_counter())
+            done.set()
+            for thread in threads:
+                thread.join()
+            throughput = "  ".join(
+                f"{name} {len([at for at in completed if start <= at < end]) / (end - start):6.0f} writes/s"
+                for (name, _), start, end in zip(phases, boundaries, boundaries[1:])
+            )
+            print(f"pre-vote {'on ' if pre_vote else 'off'}  {throughput}  leader changes {len(leaders) - 1}  {sorted(leaders)}")
+        finally:
+            done.set()
+            victim.send_signal(signal.SIGCONT)
+            stop_cluster(processes)
+            shutil.rmtree(directory, ignore_errors=True)
+
+
+def bench_transfer(rounds=10, concurrency=4):
+    """
+    Measure the write pause of planned leader changes on a local 3-node cluster.
+
+    Writers follow the leader while each round hands leadership to the next node
+    with /transfer_leadership. The pause is the longest gap between committed
+    writes in the second after the request, against the longest gap in the
+    quiet second before it.
+
+    Args:
+        rounds (int): Number of leadership transfers.
+        concurrency (int): Number of writers.
+    """
+    directory = tempfile.mkdtemp(prefix="raft-bench-")
+    processes = start_cluster(directory, {})
+    leader = {"port": CLUSTER_PORTS[0]}
+    completed = []
+    done = threading.Event()
+    writers = [threading.Thread(target=write_to_leader, args=(leader, completed, done, worker)) for worker in range(concurrency)]
+    durations = []
+    quiet_gaps = []
+    transfer_gaps = []
+    try:
+        for thread in writers:
+            thread.start()
+        for round_number in range(rounds):
+            time.sleep(1)
+            target = CLUSTER_PORTS[(CLUSTER_PORTS.index(leader["port"]) + 1) % len(CLUSTER_PORTS)]
+            started = time.perf_counter()
+            response = httpx.post(f"http://localhost:{leader['port']}/transfer_leadership", json={"follower_port": target}, timeout=5).json()
+            durations.append(time.perf_counter() - started)
+            if response.get("leader") == target:
+                leader["port"] = target
+            print(f"round {round_number}: {response}")
+            time.sleep(1)
+            quiet_gaps.append(longest_gap(completed, started - 1, started))
+            transfer_gaps.append(longest_gap(completed, started, started + 1))
+        report("transfer request", durations)
+        report("write gap without", quiet_gaps)
+        report("write gap with transfer", transfer_gaps)
+    finally:
+        done.set()
+        for thread in writers:
+            thread.join()
+        stop_cluster(processes)
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def bench_store(count=200000, operations=2000):
+    """
+    Measure metadata store deletes, inserts and paging with a large collection.
+
+    Topics get random names, so inserts land anywhere in key order. Paging is
+    timed right after a change, when the sorted key view has to be rebuilt,
+    and again with nothing changed in between.
+
+    Args:
+        count (int): Number of topics in the store.
+        operations (int): Number of timed deletes, inserts and pages.
+    """
+    store = MetadataStore()
+    names = [str(uuid.uuid4()) for _ in range(count + operations)]
+    for index, name in enumerate(names[:count], start=1):
+        store.apply({"index": index, "type": TOPIC, "data": {"name": name, "topicUUID": name}})
+    index = count
+    samples = {"delete": [], "insert": [], "page after change": [], "page unchanged": []}
+    for name, new_name in zip(names[:operations], names[count:]):
+        index += 1
+        started = time.perf_counter()
+        store.apply({"index": index, "type": REMOVE_TOPIC, "data": {"name": name}})
+        samples["delete"].append(time.perf_counter() - started)
+        index += 1
+        started = time.perf_counter()
+        store.apply({"index": index, "type": TOPIC, "data": {"name": new_name, "topicUUID": new_name}})
+        samples["insert"].append(time.perf_counter() - started)
+        # Only every tenth delete and insert is followed by a page, as listing is much rarer than writing
+        if index % 20 == 0:
+            started = time.perf_counter()
+            store.page("topics", name, 100)
+            samples["page after change"].append(time.perf_counter() - started)
+            started = time.perf_counter()
+            store.page("topics", name, 100)
+            samples["page unchanged"].append(time.perf_counter() - started)
+    for name, values in samples.items():
+        report(name, values)
+
+
+if __name__ == "__main__":
+    benchmark = sys.argv[1] if len(sys.argv) > 1 else "rpc"
+    if benchmark == "rpc":
+        bench_rpc(int(sys.argv[2]) if len(sys.argv) > 2 else 2000)
+    elif benchmark == "commit":
+        bench_commit(float(sys.argv[2]) if len(sys.argv) > 2 else 3.0)
+    elif benchmark == "failover":
+        bench_failover(int(sys.argv[2]) if len(sys.argv) > 2 else 10)
+    elif benchmark == "partition":
+        bench_partition(float(sys.argv[2]) if len(sys.argv) > 2 else 3.0)
+    elif benchmark == "transfer":
+        bench_transfer(int(sys.argv[2]) if len(sys.argv) > 2 else 10)
+    elif benchmark == "store":
+        bench_store(int(sys.argv[2]) if len(sys.argv) > 2 else 200000)
+    else:
+        sys.exit(__doc__)
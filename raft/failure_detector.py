@@ -0,0 +1,106 @@
+import collections
+import math
+import statistics
+import threading
+import time
+
+
+class PhiAccrualDetector:
+    """
+    Phi accrual failure detector for one peer.
+
+    Instead of a yes/no timeout, the detector learns the distribution of the
+    intervals between heartbeats from the peer, modelled as a normal
+    distribution over a sliding window, and reports suspicion as
+    phi = -log10(P(the next heartbeat is still to come)). Phi 1 means a 10%
+    chance that a heartbeat this late still arrives, phi 8 one in 10^8. A peer
+    whose heartbeats are steady is suspected soon after one goes missing,
+    while one whose heartbeats jitter, from pauses or slow disks, gets a
+    proportionally longer grace period.
+    """
+
+    def __init__(self, threshold=8.0, window=1000, min_std=0.01, first_interval=1.0):
+        """
+        Args:
+            threshold (float): Phi at which the peer is suspected to have failed.
+            window (int): Number of recent intervals the distribution is estimated from.
+            min_std (float): Lower bound on the standard deviation in seconds, so perfectly
+                regular heartbeats do not make the smallest delay look like a failure.
+            first_interval (float): Expected interval in seconds, used until one has been measured.
+        """
+        self.threshold = threshold
+        self.min_std = min_std
+        self.first_interval = first_interval
+        self.intervals = collections.deque(maxlen=window)
+        # Running sums over the window, so each heartbeat costs O(1)
+        self.total = 0.0
+        self.total_squares = 0.0
+        self.last_heartbeat = None
+        self.lock = threading.Lock()
+
+    def heartbeat(self):
+        """
+        Record a heartbeat from the peer. Safe to call from any thread.
+        """
+        now = time.monotonic()
+        with self.lock:
+            if self.last_heartbeat is not None:
+                interval = now - self.last_heartbeat
+                if len(self.intervals) == self.intervals.maxlen:
+                    oldest = self.intervals[0]
+                    self.total -= oldest
+                    self.total_squares -= oldest * oldest
+                self.intervals.append(interval)
+                self.total += interval
+                self.total_squares += interval * interval
+            self.last_heartbeat = now
+
+    def distribution(self):
+        """
+        Returns:
+            statistics.NormalDist: The estimated distribution of heartbeat intervals.
+        """
+        with self.lock:
+            count = len(self.intervals)
+            if count == 0:
+                return statistics.NormalDist(self.first_interval, max(self.first_interval / 4, self.min_std))
+            mean = self.total / count
+            variance = max(0.0, self.total_squares / count - mean * mean)
+        return statistics.NormalDist(mean, max(math.sqrt(variance), self.min_std))
+
+    def phi(self):
+        """
+        Returns:
+            float: The current suspicion level, or 0 before the first heartbeat.
+        """
+        if self.last_heartbeat is None:
+            return 0.0
+        elapsed = time.monotonic() - self.last_heartbeat
+        later = 1.0 - self.distribution().cdf(elapsed)
+        return -math.log10(max(later, 1e-300))
+
+    def timeout(self):
+        """
+        Returns:
+            float: Seconds after a heartbeat at which phi reaches the threshold if no other arrives.
+        """
+        # Phi reaches the threshold where the chance of a later heartbeat drops to 10^-threshold
+        return self.distribution().inv_cdf(1.0 - 10 ** -min(self.threshold, 15.0))
+
+    def state(self):
+        """
+        Returns:
+            dict: The learned interval statistics in milliseconds, the current phi and whether the peer is suspected.
+        """
+        distribution = self.distribution()
+        phi = self.phi()
+        last_heartbeat = self.last_heartbeat
+        return {
+            "samples": len(self.intervals),
+            "mean_interval_ms": round(distribution.mean * 1000, 3),
+            "std_interval_ms": round(distribution.stdev * 1000, 3),
+            "since_last_ms": None if last_heartbeat is None else round((time.monotonic() - last_heartbeat) * 1000, 3),
+            "timeout_ms": round(self.timeout() * 1000, 3),
+            "phi": round(phi, 3),
+            "suspected": phi >= self.threshold,
+        }
@@ -0,0 +1,536 @@
+import bisect
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+# Sections of the metadata document, in the order they appear in metajson_schema.json
+SECTIONS = (
+    "RegisterBrokerRecords",
+    "TopicRecord",
+    "PartitionRecord",
+    "ProducerIdsRecord",
+    "RegistrationChangeBrokerRecord",
+    "ProducerIdBlockRecord",
+)
+
+# Log entry types understood by the state machine
+REGISTER_BROKER = "RegisterBrokerRecord"
+UNREGISTER_BROKER = "UnregisterBrokerRecord"
+BROKER_CHANGE = "RegistrationChangeBrokerRecord"
+TOPIC = "TopicRecord"
+REMOVE_TOPIC = "RemoveTopicRecord"
+PARTITION = "PartitionRecord"
+REMOVE_PARTITION = "RemovePartitionRecord"
+PRODUCER_IDS = "ProducerIdsRecord"
+PRODUCER_ID_BLOCK = "ProducerIdBlockRecord"
+NO_OP = "NoOpRecord"
+# Several of the records above committed and applied as one entry
+BATCH = "BatchRecord"
+
+# Log entry types behind each kind of record a watch can be limited to
+WATCH_KINDS = {
+    "brokers": (REGISTER_BROKER, UNREGISTER_BROKER, BROKER_CHANGE),
+    "topics": (TOPIC, REMOVE_TOPIC),
+    "partitions": (PARTITION, REMOVE_PARTITION),
+    "producers": (PRODUCER_IDS, PRODUCER_ID_BLOCK),
+}
+
+# Producer IDs are allocated to brokers in blocks of this many; block n holds
+# IDs n * PRODUCER_ID_BLOCK_SIZE up to (n + 1) * PRODUCER_ID_BLOCK_SIZE - 1
+PRODUCER_ID_BLOCK_SIZE = 1000
+
+
+def expand_entry(entry: dict) -> List[dict]:
+    """
+    Split a batch log entry into one entry per record it holds.
+
+    Args:
+        entry (dict): A log entry.
+
+    Returns:
+        list: The entry itself, or for a batch one entry per record with the batch's index, term and timestamp.
+    """
+    if entry["type"] != BATCH:
+        return [entry]
+    return [{**entry, "type": record["type"], "data": record["data"]} for record in entry["data"]["records"]]
+
+
+class SortedKeys:
+    """
+    Sorted keys split into buckets of a few hundred, for paging large collections.
+
+    Adding or removing a key bisects the bucket maxima and then edits one
+    short bucket, so neither moves more than a bucket's worth of keys however
+    large the collection grows, unlike inserting into or deleting from one
+    sorted list. Buckets are split when they grow to twice BUCKET_SIZE and
+    dropped when they empty.
+    """
+
+    BUCKET_SIZE = 512
+
+    def __init__(self, keys=()):
+        keys = sorted(keys)
+        self.buckets = [keys[start:start + self.BUCKET_SIZE] for start in range(0, len(keys), self.BUCKET_SIZE)]
+        self.maxes = [bucket[-1] for bucket in self.buckets]
+        self.size = len(keys)
+
+    def __len__(self):
+        return self.size
+
+    def add(self, key):
+        if not self.buckets:
+            self.buckets.append([key])
+            self.maxes.append(key)
+            self.size = 1
+            return
+        position = min(bisect.bisect_left(self.maxes, key), len(self.maxes) - 1)
+        bucket = self.buckets[position]
+        at = bisect.bisect_left(bucket, key)
+        if at < len(bucket) and bucket[at] == key:
+            return
+        bucket.insert(at, key)
+        self.maxes[position] = bucket[-1]
+        self.size += 1
+        if len(bucket) >= 2 * self.BUCKET_SIZE:
+            self.buckets[position:position + 1] = [bucket[:self.BUCKET_SIZE], bucket[self.BUCKET_SIZE:]]
+            self.maxes[position:position + 1] = [bucket[self.BUCKET_SIZE - 1], bucket[-1]]
+
+    def remove(self, key):
+        position = bisect.bisect_left(self.maxes, key)
+        if position == len(self.maxes):
+            return
+        bucket = self.buckets[position]
+        at = bisect.bisect_left(bucket, key)
+        if at == len(bucket) or bucket[at] != key:
+            return
+        del bucket[at]
+        self.size -= 1
+        if bucket:
+            self.maxes[position] = bucket[-1]
+        else:
+            del self.buckets[position]
+            del self.maxes[position]
+
+    def after(self, key=None):
+        """
+        Iterate the keys in order, starting after a key.
+
+        Args:
+            key: Only keys greater than this one are returned; all keys if None.
+        """
+        position = 0 if key is None else bisect.bisect_right(self.maxes, key)
+        for bucket in self.buckets[position:]:
+            start = 0 if key is None else bisect.bisect_right(bucket, key)
+            yield from bucket[start:]
+            key = None
+
+
+class KeyIndex:
+    """
+    Sorted primary keys, grouped by the value of one record attribute.
+
+    Keeping the keys sorted lets a page of records after a cursor be found by
+    bisection instead of a scan. An index without an attribute keeps every
+    key in the single group None.
+    """
+
+    def __init__(self):
+        self.groups: Dict[Any, SortedKeys] = {}
+
+    def add(self, key, value=None):
+        self.groups.setdefault(value, SortedKeys()).add(key)
+
+    def remove(self, key, value=None):
+        keys = self.groups.get(value)
+        if keys is None:
+            return
+        keys.remove(key)
+        if not keys:
+            del self.groups[value]
+
+    def keys(self, value=None) -> SortedKeys:
+        return self.groups.get(value, SortedKeys())
+
+    def rebuild(self, pairs):
+        """
+        Replace the contents in one go.
+
+        Args:
+            pairs (iterable): (key, value) tuples in any order.
+        """
+        groups: Dict[Any, list] = {}
+        for key, value in pairs:
+            groups.setdefault(value, []).append(key)
+        self.groups = {value: SortedKeys(keys) for value, keys in groups.items()}
+
+
+class MetadataStore:
+    """
+    Resident metadata state machine.
+
+    Holds the cluster metadata in memory, keyed by each record's identity, and
+    mutates it only by applying committed log entries. Reads never touch disk.
+    Secondary indexes are maintained alongside the records so that every point
+    lookup, existence check and delete is a dict operation.
+    """
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self._reset()
+
+    def _reset(self):
+        self.brokers: Dict[int, dict] = {}
+        self.topics: Dict[str, dict] = {}
+        self.partitions: Dict[int, dict] = {}
+        self.producers: Dict[Tuple[str, int], dict] = {}
+        # Allocated producer ID blocks; block n is at position n, so the owner of an ID is one division away
+        self.producer_blocks: List[dict] = []
+        # Latest registration change per broker, most recently changed last
+        self.broker_changes: Dict[int, dict] = {}
+        # Secondary indexes: internal_uuid -> brokerId, topicUUID -> {partitionId: partition}, topicUUID -> name
+        self.broker_uuids: Dict[str, int] = {}
+        self.topic_partitions: Dict[str, Dict[int, dict]] = {}
+        self.topic_uuids: Dict[str, str] = {}
+        # Sorted keys for paging, overall and by the attributes list endpoints filter on
+        self.broker_keys = KeyIndex()
+        self.brokers_by_status = KeyIndex()
+        self.brokers_by_rack = KeyIndex()
+        self.topic_keys = KeyIndex()
+        self.partition_keys = KeyIndex()
+        self.partitions_by_topic = KeyIndex()
+        self.partitions_by_leader = KeyIndex()
+        self.producer_keys = KeyIndex()
+        self.producers_by_broker = KeyIndex()
+        self.timestamps: Dict[str, str] = {section: "" for section in SECTIONS}
+        # Log index of the last entry that changed each section; only ever grows
+        self.versions: Dict[str, int] = {section: 0 for section in SECTIONS}
+        self._applying_index = 0
+        self.applied_index = 0
+        self.applied_term = 0
+
+    # Reads
+
+    def get_broker(self, broker_id: int) -> Optional[dict]:
+        return self.brokers.get(broker_id)
+
+    def get_broker_by_uuid(self, internal_uuid: str) -> Optional[dict]:
+        broker_id = self.broker_uuids.get(internal_uuid)
+        return None if broker_id is None else self.brokers.get(broker_id)
+
+    def get_topic(self, name: str) -> Optional[dict]:
+        return self.topics.get(name)
+
+    def get_topic_by_uuid(self, topic_uuid: str) -> Optional[dict]:
+        name = self.topic_uuids.get(topic_uuid)
+        return None if name is None else self.topics.get(name)
+
+    def get_partition(self, partition_id: int) -> Optional[dict]:
+        return self.partitions.get(partition_id)
+
+    def get_topic_partitions(self, topic_uuid: str) -> List[dict]:
+        return list(self.topic_partitions.get(topic_uuid, {}).values())
+
+    def get_producer(self, broker_id: str, producer_id: int) -> Optional[dict]:
+        return self.producers.get((broker_id, producer_id))
+
+    def get_producer_id_block(self, producer_id: int) -> Optional[dict]:
+        block = producer_id // PRODUCER_ID_BLOCK_SIZE
+        if producer_id < 0 or block >= len(self.producer_blocks):
+            return None
+        return self.producer_blocks[block]
+
+    def list_brokers(self) -> List[dict]:
+        return list(self.brokers.values())
+
+    def list_topics(self) -> List[dict]:
+        return list(self.topics.values())
+
+    def list_partitions(self) -> List[dict]:
+        return list(self.partitions.values())
+
+    def list_producers(self) -> List[dict]:
+        return list(self.producers.values())
+
+    def list_producer_id_blocks(self) -> List[dict]:
+        return list(self.producer_blocks)
+
+    def page(self, kind: str, after=None, limit: Optional[int] = None, **filters) -> Tuple[List[dict], Any]:
+        """
+        Read one page of records in key order, optionally filtered by indexed attributes.
+
+        Walks the keys of the most selective filter and checks any other filters
+        on each record, so a page never loads the whole collection.
+
+        Args:
+            kind (str): "brokers", "topics", "partitions" or "producers".
+            after: The key of the last record of the previous page, or None for the first page.
+            limit (int, optional): Upper bound on the records returned.
+            **filters: Attribute values the records must have; None matches anything.
+
+        Returns:
+            tuple: (records, last_key) where last_key is the cursor for the next page,
+                or None if there are no more records.
+        """
+        records, keys, indexes = {
+            "brokers": (self.brokers, self.broker_keys, {"brokerStatus": self.brokers_by_status, "rackId": self.brokers_by_rack}),
+            "topics": (self.topics, self.topic_keys, {}),
+            "partitions": (self.partitions, self.partition_keys, {"topicUUID": self.partitions_by_topic, "leader": self.partitions_by_leader}),
+            "producers": (self.producers, self.producer_keys, {"brokerId": self.producers_by_broker}),
+        }[kind]
+        filters = {name: value for name, value in filters.items() if value is not None}
+        candidates = min([indexes[name].keys(value) for name, value in filters.items()] or [keys.keys()], key=len)
+        remaining = candidates.after(after)
+        page = []
+        for key in remaining:
+            record = records[key]
+            if all(record.get(name) == value for name, value in filters.items()):
+                page.append(record)
+                if limit is not None and len(page) == limit:
+                    return page, key if next(remaining, None) is not None else None
+        return page, None
+
+    def section(self, name: str) -> dict:
+        """
+        Build one section of the metadata document.
+
+        Args:
+            name (str): One of SECTIONS.
+
+        Returns:
+            dict: The section in the {"records": [...], "timestamp": ...} layout.
+        """
+        records = {
+            "RegisterBrokerRecords": self.list_brokers,
+            "TopicRecord": self.list_topics,
+            "PartitionRecord": self.list_partitions,
+            "ProducerIdsRecord": self.list_producers,
+            "RegistrationChangeBrokerRecord": lambda: list(self.broker_changes.values()),
+            "ProducerIdBlockRecord": self.list_producer_id_blocks,
+        }[name]()
+        return {"records": records, "timestamp": self.timestamps[name]}
+
+    # Writes
+
+    def apply(self, entry: dict):
+        """
+        Apply a committed log entry to the state machine.
+
+        Entries carry every generated value (UUIDs, timestamps) so applying the
+        same entry on any node yields the same state.
+
+        Args:
+            entry (dict): A log entry with "index", "type", "timestamp" and "data".
+
+        Returns:
+            The result of the command, handed back to the proposing endpoint.
+        """
+        handler = getattr(self, f"_apply_{entry['type']}", None)
+        if handler is None:
+            raise ValueError(f"Unknown log entry type: {entry['type']}")
+        with self.lock:
+            self._applying_index = entry["index"]
+            result = handler(entry["data"], entry.get("timestamp", ""))
+            self.applied_index = entry["index"]
+            self.applied_term = entry.get("term", 0)
+            return result
+
+    # Index maintenance
+
+    def _add_broker(self, broker):
+        broker_id = broker["brokerId"]
+        previous = self.brokers.get(broker_id)
+        if previous is not None:
+            self.broker_uuids.pop(previous["internal_uuid"], None)
+            self.brokers_by_status.remove(broker_id, previous.get("brokerStatus"))
+            self.brokers_by_rack.remove(broker_id, previous.get("rackId"))
+        self.brokers[broker_id] = broker
+        self.broker_uuids[broker["internal_uuid"]] = broker_id
+        self.broker_keys.add(broker_id)
+        self.brokers_by_status.add(broker_id, broker.get("brokerStatus"))
+        self.brokers_by_rack.add(broker_id, broker.get("rackId"))
+
+    def _remove_broker(self, broker_id):
+        broker = self.brokers.pop(broker_id, None)
+        if broker is not None:
+            self.broker_uuids.pop(broker["internal_uuid"], None)
+            self.broker_keys.remove(broker_id)
+            self.brokers_by_status.remove(broker_id, broker.get("brokerStatus"))
+            self.brokers_by_rack.remove(broker_id, broker.get("rackId"))
+        return broker
+
+    def _add_partition(self, partition):
+        partition_id = partition["partitionId"]
+        previous = self.partitions.get(partition_id)
+        if previous is not None and previous["topicUUID"] != partition["topicUUID"]:
+            self._remove_partition(partition_id)
+        elif previous is not None:
+            self.partitions_by_leader.remove(partition_id, previous.get("leader"))
+        self.partitions[partition_id] = partition
+        self.topic_partitions.setdefault(partition["topicUUID"], {})[partition_id] = partition
+        self.partition_keys.add(partition_id)
+        self.partitions_by_topic.add(partition_id, partition["topicUUID"])
+        self.partitions_by_leader.add(partition_id, partition.get("leader"))
+
+    def _remove_partition(self, partition_id):
+        partition = self.partitions.pop(partition_id, None)
+        if partition is not None:
+            siblings = self.topic_partitions.get(partition["topicUUID"], {})
+            siblings.pop(partition_id, None)
+            if not siblings:
+                self.topic_partitions.pop(partition["topicUUID"], None)
+            self.partition_keys.remove(partition_id)
+            self.partitions_by_topic.remove(partition_id, partition["topicUUID"])
+            self.partitions_by_leader.remove(partition_id, partition.get("leader"))
+        return partition
+
+    def _rebuild_indexes(self):
+        """
+        Rebuild every secondary index from the primary maps, e.g. after a restore.
+        """
+        self.broker_uuids = {broker["internal_uuid"]: broker_id for broker_id, broker in self.brokers.items()}
+        self.topic_uuids = {topic["topicUUID"]: name for name, topic in self.topics.items()}
+        self.topic_partitions = {}
+        for partition_id, partition in self.partitions.items():
+            self.topic_partitions.setdefault(partition["topicUUID"], {})[partition_id] = partition
+        self.broker_keys.rebuild((broker_id, None) for broker_id in self.brokers)
+        self.brokers_by_status.rebuild((broker_id, broker.get("brokerStatus")) for broker_id, broker in self.brokers.items())
+        self.brokers_by_rack.rebuild((broker_id, broker.get("rackId")) for broker_id, broker in self.brokers.items())
+        self.topic_keys.rebuild((name, None) for name in self.topics)
+        self.partition_keys.rebuild((partition_id, None) for partition_id in self.partitions)
+        self.partitions_by_topic.rebuild((partition_id, partition["topicUUID"]) for partition_id, partition in self.partitions.items())
+        self.partitions_by_leader.rebuild((partition_id, partition.get("leader")) for partition_id, partition in self.partitions.items())
+        self.producer_keys.rebuild((key, None) for key in self.producers)
+        self.producers_by_broker.rebuild((key, key[0]) for key in self.producers)
+
+    # Registrations are first-writer-wins, so two proposals for the same identity that
+    # raced through the log resolve to the same record on every node
+
+    def _changed(self, section, timestamp):
+        self.timestamps[section] = timestamp
+        self.versions[section] = self._applying_index
+
+    def _apply_NoOpRecord(self, data, timestamp):
+        return None
+
+    def _apply_BatchRecord(self, data, timestamp):
+        handlers = []
+        for record in data["records"]:
+            handler = getattr(self, f"_apply_{record['type']}", None)
+            if handler is None or record["type"] == BATCH:
+                raise ValueError(f"Unknown batch record type: {record['type']}")
+            handlers.append(handler)
+        return [handler(record["data"], timestamp) for handler, record in zip(handlers, data["records"])]
+
+    def _apply_RegisterBrokerRecord(self, data, timestamp):
+        if data["brokerId"] in self.brokers:
+            return self.brokers[data["brokerId"]]["internal_uuid"]
+        self._add_broker(data)
+        self._changed("RegisterBrokerRecords", timestamp)
+        return data["internal_uuid"]
+
+    def _apply_UnregisterBrokerRecord(self, data, timestamp):
+        self._changed("RegisterBrokerRecords", timestamp)
+        self.broker_changes.pop(data["brokerId"], None)
+        return self._remove_broker(data["brokerId"])
+
+    def _apply_RegistrationChangeBrokerRecord(self, data, timestamp):
+        broker = self.brokers.get(data["brokerId"])
+        if broker is None:
+            return None
+        updated = {**broker, **data}
+        updated["epoch"] += 1
+        self._add_broker(updated)
+        # Superseded changes only live on in the log, so the state stays bounded by the broker count
+        self.broker_changes.pop(data["brokerId"], None)
+        self.broker_changes[data["brokerId"]] = data
+        self._changed("RegisterBrokerRecords", timestamp)
+        self._changed("RegistrationChangeBrokerRecord", timestamp)
+        return updated
+
+    def _apply_TopicRecord(self, data, timestamp):
+        if data["name"] in self.topics:
+            return self.topics[data["name"]]["topicUUID"]
+        self.topics[data["name"]] = data
+        self.topic_uuids[data["topicUUID"]] = data["name"]
+        self.topic_keys.add(data["name"])
+        self._changed("TopicRecord", timestamp)
+        return data["topicUUID"]
+
+    def _apply_RemoveTopicRecord(self, data, timestamp):
+        self._changed("TopicRecord", timestamp)
+        self.topic_keys.remove(data["name"])
+        topic = self.topics.pop(data["name"], None)
+        if topic is not None:
+            self.topic_uuids.pop(topic["topicUUID"], None)
+        return topic
+
+    def _apply_PartitionRecord(self, data, timestamp):
+        if data["partitionId"] in self.partitions:
+            return self.partitions[data["partitionId"]]["partitionId"]
+        self._add_partition(data)
+        self._changed("PartitionRecord", timestamp)
+        return data["topicUUID"]
+
+    def _apply_RemovePartitionRecord(self, data, timestamp):
+        self._changed("PartitionRecord", timestamp)
+        return self._remove_partition(data["partitionId"])
+
+    def _apply_ProducerIdsRecord(self, data, timestamp):
+        if (data["brokerId"], data["producerId"]) in self.producers:
+            return data["producerId"]
+        key = (data["brokerId"], data["producerId"])
+        self.producers[key] = data
+        self.producer_keys.add(key)
+        self.producers_by_broker.add(key, data["brokerId"])
+        self._changed("ProducerIdsRecord", timestamp)
+        return data["producerId"]
+
+    def _apply_ProducerIdBlockRecord(self, data, timestamp):
+        # The leader assigns the range in log order when appending; older entries without one get it here
+        first = data.get("firstProducerId", len(self.producer_blocks) * PRODUCER_ID_BLOCK_SIZE)
+        block = {**data, "firstProducerId": first, "lastProducerId": first + PRODUCER_ID_BLOCK_SIZE - 1}
+        self.producer_blocks.append(block)
+        self._changed("ProducerIdBlockRecord", timestamp)
+        return block
+
+    # Serialisation
+
+    def to_dict(self) -> dict:
+        """
+        Export the state in the metadata.json layout.
+
+        Returns:
+            dict: Every section of the metadata document.
+        """
+        with self.lock:
+            return {name: self.section(name) for name in SECTIONS}
+
+    def restore(self, data: dict, applied_index: int = 0, applied_term: int = 0):
+        """
+        Replace the state with a metadata document.
+
+        Args:
+            data (dict): A document in the metadata.json layout.
+            applied_index (int): The log index the document reflects.
+            applied_term (int): The term of that log entry.
+        """
+        with self.lock:
+            self._reset()
+            for broker in data.get("RegisterBrokerRecords", {}).get("records", []):
+                self.brokers[broker["brokerId"]] = broker
+            for topic in data.get("TopicRecord", {}).get("records", []):
+                self.topics[topic["name"]] = topic
+            for partition in data.get("PartitionRecord", {}).get("records", []):
+                self.partitions[partition["partitionId"]] = partition
+            for producer in data.get("ProducerIdsRecord", {}).get("records", []):
+                self.producers[(producer["brokerId"], producer["producerId"])] = producer
+            self.producer_blocks = sorted(data.get("ProducerIdBlockRecord", {}).get("records", []), key=lambda block: block["firstProducerId"])
+            for change in data.get("RegistrationChangeBrokerRecord", {}).get("records", []):
+                self.broker_changes.pop(change["brokerId"], None)
+                self.broker_changes[change["brokerId"]] = change
+            self._rebuild_indexes()
+            for section in SECTIONS:
+                self.timestamps[section] = data.get(section, {}).get("timestamp", "")
+                # Which entries changed which section is not in the snapshot, so every section moves on
+                self.versions[section] = applied_index
+            self.applied_index = applied_index
+            self.applied_term = applied_term
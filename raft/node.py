@@ -1,29 +1,136 @@
 import os
+import asyncio
+import base64
+import heapq
+import itertools
 import json
 import random
-import requests
 import time
 import sys
 import threading
 import uuid
-from fastapi import FastAPI, BackgroundTasks
+from concurrent.futures import ThreadPoolExecutor
+from fastapi import FastAPI, Header, Query
+from fastapi.responses import Response, StreamingResponse
 from pydantic import BaseModel
-from datetime import datetime, timedelta
+from datetime import datetime
 from schema import *
 from utils import *
+from metadata_store import *
+from segment_log import SegmentLog
+from snapshot import SnapshotStore
+from rpc import PeerPool, RPCError
+from replication import ReplicationScheduler
+from stream import Subscriber, entry_events, format_event
+from audit import AuditLogger
+from timers import Timer
+from failure_detector import PhiAccrualDetector
 
 app = FastAPI()
+loop_monitor = LoopLagMonitor()
 
 # Define the base class for Node
 class Node:
-    def __init__(self, port):
+    # The uvicorn event loop, set once the server has started
+    loop = None
+
+    def __init__(self, port, previous=None):
         self.port = port
-        self.last_heartbeat_time = None
-        self.timeout = 5
-        self.heartbeat_interval = 2
-        self.current_term = 0
         self.config = self.read_config("config.json")
-        self.create_node_files()
+        # The leader sends AppendEntries every heartbeat_interval seconds; a follower stands for
+        # election once its failure detector suspects the leader, but never within election_timeout_min,
+        # plus a random spread of up to election_timeout_max - election_timeout_min against split votes
+        self.heartbeat_interval = self.config.get("heartbeat_interval", 0.05)
+        self.election_timeout_min = self.config.get("election_timeout_min", 0.15)
+        self.election_timeout_max = self.config.get("election_timeout_max", 0.3)
+        # Phi accrual failure detectors, by peer port: followers watch the leader's AppendEntries,
+        # the leader its followers' acknowledgements
+        self.phi_threshold = self.config.get("phi_threshold", 8.0)
+        self.phi_window = self.config.get("phi_window", 1000)
+        self.phi_min_std = self.config.get("phi_min_std", 0.01)
+        self.detectors = {}
+        # Only followers run an election timer
+        self.election_timer = None
+        # Monotonic time of the last AppendEntries or InstallSnapshot from a current leader
+        self.leader_contact = None
+        # Hold a pre-vote round before each election, so a node that cannot win never raises its term
+        self.pre_vote = self.config.get("pre_vote", True)
+        # currentTerm and votedFor, persisted before any RPC that depends on them is answered
+        self.state_path = f"{port}/raft_state.json"
+        self.fsync_policy = self.config.get("fsync_policy", "interval")
+        self.segment_bytes = self.config.get("segment_bytes", 16 * 1024 * 1024)
+        # Snapshot once either this many entries or this many log bytes accumulate
+        self.snapshot_entries = self.config.get("snapshot_entries", 10000)
+        self.snapshot_bytes = self.config.get("snapshot_bytes", 64 * 1024 * 1024)
+        self.max_append_entries = self.config.get("max_append_entries", 500)
+        # Seconds a client write waits for a majority before giving up on an answer
+        self.commit_timeout = self.config.get("commit_timeout", 5)
+        # Applied entries buffered per stream subscriber before it is disconnected
+        self.stream_buffer = self.config.get("stream_buffer", 1000)
+        self.max_page_size = self.config.get("max_page_size", 1000)
+        self.max_fetch_records = self.config.get("max_fetch_records", 1000)
+        self.max_batch_records = self.config.get("max_batch_records", 10000)
+        # Guards the log, the term and the vote
+        self.log_lock = threading.RLock()
+        # Reads waiting for the state machine to reach their read index, as a heap of (index, seq, future)
+        self.applied_waiters = []
+        self.waiter_seq = itertools.count()
+        self.subscribers = set()
+        # Serialized list responses by name, as (version, body)
+        self.response_cache = {}
+        if previous is not None:
+            previous.stop()
+            self.peers = previous.peers
+            self.disk = previous.disk
+            self.log_lock = previous.log_lock
+            self.current_term = previous.current_term
+            self.voted_for = previous.voted_for
+            self.detectors = previous.detectors
+            # A deposed leader was in touch with a leader until now, so it refuses pre-votes for an election timeout
+            self.leader_contact = time.monotonic() if isinstance(previous, Leader) else previous.leader_contact
+            # Changing role keeps the open logs and the applied state of the previous role
+            self.store = previous.store
+            self.log = previous.log
+            self.audit = previous.audit
+            self.snapshots = previous.snapshots
+            self.commit_index = previous.commit_index
+            self.snapshot_index = previous.snapshot_index
+            self.snapshot_term = previous.snapshot_term
+            self.snapshot_log_bytes = previous.snapshot_log_bytes
+            self.applied_waiters = previous.applied_waiters
+            self.waiter_seq = previous.waiter_seq
+            self.subscribers = previous.subscribers
+            self.response_cache = previous.response_cache
+        else:
+            # Keep-alive HTTP clients shared by heartbeats, votes and registration
+            self.peers = PeerPool(
+                connect_timeout=self.config.get("rpc_connect_timeout", 0.5),
+                read_timeout=self.config.get("rpc_read_timeout", 2.0),
+            )
+            # Appends the leader's log entries in order, off the event loop
+            self.disk = ThreadPoolExecutor(max_workers=1, thread_name_prefix="disk")
+            self.create_node_files()
+            self.load_state()
+            self.recover()
+
+    def recover(self):
+        """
+        Rebuild the metadata store from the latest snapshot.
+
+        Log entries after the snapshot are applied once the commit index is known
+        again: from the leader's heartbeats, or by committing a new entry as leader.
+        """
+        self.store = MetadataStore()
+        self.snapshot_index = 0
+        self.snapshot_term = 0
+        self.snapshot_log_bytes = 0
+        snapshot = self.snapshots.latest()
+        if snapshot is not None:
+            self.snapshot_index = snapshot["last_included_index"]
+            self.snapshot_term = snapshot["last_included_term"]
+            self.store.restore(snapshot["metadata"], self.snapshot_index, self.snapshot_term)
+            print(f"Recovered metadata from snapshot at log index {self.snapshot_index}")
+        self.commit_index = self.snapshot_index
 
     @classmethod
     def initialize_node(cls, port):
@@ -39,27 +146,36 @@ class Node:
         try:
             config = cls.read_config("config.json")
         except:
-            config = {"leader_node": None, "follower_nodes": [] , "is_election": False , "term": 0}
+            config = {"leader_node": None, "follower_nodes": []}
             cls.write_config("config.json", config)
 
-        if port == config["leader_node"]:
+        if config["leader_node"] is None:
+            # The first node of a new cluster leads it
+            config["leader_node"] = port
+            cls.write_config("config.json", config)
             return Leader(port)
-        else:
-            if config["leader_node"] is None:
-                config["leader_node"] = port
-                cls.write_config("config.json", config)
-                return Leader(port)
-            else:
-                return Follower(port, config["leader_node"])
+        if port == config["leader_node"]:
+            # A restarted leader may have been replaced meanwhile, so it only leads again by winning an election
+            return Follower(port, None)
+        return Follower(port, config["leader_node"])
 
     def create_node_files(self):
         """
         Create node-specific files and directories.
         """
         os.makedirs(str(self.port), exist_ok=True)
-        metadata_template = self.read_metadata_template()
-        self.create_or_update_file(f"{self.port}/metadata.json", metadata_template)
-        self.create_or_update_file(f"{self.port}/eventlog.json", [])
+        self.snapshots = SnapshotStore(f"{self.port}/snapshots")
+        self.log = SegmentLog(f"{self.port}/log", segment_bytes=self.segment_bytes, fsync_policy=self.fsync_policy)
+        self.audit = AuditLogger(
+            f"{self.port}/audit",
+            # Fraction of events recorded, by endpoint or event type; heartbeats are sampled unless configured
+            sample_rates={"heartbeat_sent": 0.01, "heartbeat_received": 0.01, **self.config.get("audit_sample_rates", {})},
+            default_rate=self.config.get("audit_sample_rate", 1.0),
+            buffer_size=self.config.get("audit_buffer", 10000),
+            flush_interval=self.config.get("audit_flush_interval", 1.0),
+            segment_bytes=self.config.get("audit_segment_bytes", 16 * 1024 * 1024),
+            retention_bytes=self.config.get("audit_retention_bytes", 64 * 1024 * 1024),
+        )
 
     def create_or_update_file(self, file_path, data):
         """
@@ -91,46 +207,160 @@ class Node:
         except json.JSONDecodeError:
             sys.exit("Configuration file is invalid.")
 
-    def read_metadata_template(self):
-        """
-        Read the metadata schema template.
-
-        Returns:
-            dict: The metadata schema template.
-        """
-        try:
-            with open("metajson_schema.json", "r") as file:
-                return json.load(file)
-        except FileNotFoundError:
-            print("Metadata schema file not found.")
-            return {}  # Return an empty dict or handle this case as needed
-        except json.JSONDecodeError:
-            print("Metadata schema file is invalid.")
-            return {}  # Return an empty dict or handle this case as needed
-
     @staticmethod
     def write_config(file_path, data):
         """
         Write data to the configuration file.
 
+        The file is replaced atomically, as other nodes read it at any time.
+
         Args:
             file_path (str): The path to the configuration file.
             data: The data to write to the file.
         """
-        with open(file_path, "w") as file:
+        tmp_path = f"{file_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as file:
             json.dump(data, file, indent=4)
+        os.replace(tmp_path, file_path)
+
+    def load_state(self):
+        """
+        Read the persisted current term and the candidate voted for in it.
+        """
+        try:
+            with open(self.state_path, "r") as file:
+                state = json.load(file)
+        except FileNotFoundError:
+            state = {"current_term": 0, "voted_for": None}
+        self.current_term = state["current_term"]
+        self.voted_for = state["voted_for"]
+
+    def save_state(self):
+        """
+        Persist the current term and vote. The file is fsynced and renamed into place,
+        so a crash leaves either the old or the new state. Call with log_lock held.
+        """
+        tmp_path = f"{self.state_path}.tmp"
+        with open(tmp_path, "w") as file:
+            json.dump({"current_term": self.current_term, "voted_for": self.voted_for}, file)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(tmp_path, self.state_path)
+
+    def observe_term(self, term):
+        """
+        Move to a newer term seen in an RPC, without a vote in it. Call with log_lock held.
+
+        Args:
+            term (int): The term carried by a request or response.
 
-    def update_eventlog(self, action, port):
+        Returns:
+            bool: True if the term was newer than the current one.
+        """
+        if term <= self.current_term:
+            return False
+        self.current_term = term
+        self.voted_for = None
+        self.save_state()
+        return True
+
+    def adopt_term(self, term, leader_port=None):
+        """
+        Move to a newer term seen in an RPC; a leader of an older term steps down to follower.
+        Blocking; run off the event loop.
+
+        Args:
+            term (int): The term carried by a request or response.
+            leader_port (int, optional): The leader of that term, if known.
+        """
+        global node
+        with self.log_lock:
+            newer = self.observe_term(term)
+            if newer and isinstance(self, Leader) and node is self:
+                print(f"Stepping down: saw term {term}")
+                node = Follower(self.port, leader_port, previous=self)
+
+    def reset_election_timer(self):
+        """
+        Put off the next election by a fresh election timeout: the time until the current
+        leader is suspected, at least election_timeout_min, plus a random spread.
+        """
+        if self.election_timer is not None:
+            timeout = self.election_timeout_min
+            if self.leader_port is not None:
+                timeout = max(timeout, self.detector(self.leader_port).timeout())
+            self.election_timer.reset(timeout + random.uniform(0, self.election_timeout_max - self.election_timeout_min))
+
+    def detector(self, port):
         """
-        Update the event log with an action and port information.
+        Return the failure detector of a peer, creating it on first use.
 
         Args:
-            action (str): The action to log.
-            port (int): The port number associated with the action.
+            port (int): The peer's port.
+
+        Returns:
+            PhiAccrualDetector: The detector fed by the peer's heartbeats.
+        """
+        detector = self.detectors.get(port)
+        if detector is None:
+            detector = self.detectors.setdefault(
+                port, PhiAccrualDetector(self.phi_threshold, self.phi_window, self.phi_min_std, first_interval=self.heartbeat_interval)
+            )
+        return detector
+
+    def hears_leader(self):
         """
-        eventlog = self.read_file(f"{self.port}/eventlog.json")
-        eventlog.append({"timestamp": datetime.now().isoformat(), f"port_{action}": port})
-        self.create_or_update_file(f"{self.port}/eventlog.json", eventlog)
+        Returns:
+            bool: Whether this node leads or heard from the leader within the minimum election timeout.
+        """
+        if isinstance(self, Leader):
+            return True
+        return self.leader_contact is not None and time.monotonic() - self.leader_contact < self.election_timeout_min
+
+    def member_ports(self):
+        """
+        Returns:
+            list: The ports of the other cluster members listed in config.json.
+        """
+        config = self.read_config("config.json")
+        members = {int(port) for port in config["follower_nodes"]}
+        if config["leader_node"] is not None:
+            members.add(int(config["leader_node"]))
+        members.discard(self.port)
+        return sorted(members)
+
+    def request_vote(self, request):
+        """
+        Handle a RequestVote request from a candidate.
+
+        A vote is granted at most once per term, and only to a candidate whose log is at
+        least as up to date as this node's, so an elected leader holds every committed entry.
+        A pre-vote changes neither the term nor the vote. It is granted for a later term to a
+        candidate with an up-to-date log, unless this node still hears from a leader.
+
+        Args:
+            request (dict): term, candidate_id, last_log_index, last_log_term and pre_vote.
+
+        Returns:
+            dict: The current term and whether the vote was granted.
+        """
+        with self.log_lock:
+            if request["pre_vote"]:
+                if request["term"] <= self.current_term or self.hears_leader():
+                    return {"term": self.current_term, "vote_granted": False}
+            else:
+                self.observe_term(request["term"])
+                if request["term"] < self.current_term or self.voted_for not in (None, request["candidate_id"]):
+                    return {"term": self.current_term, "vote_granted": False}
+            last_log_index = self.log.last_offset
+            if (request["last_log_term"], request["last_log_index"]) < (self.term_at(last_log_index), last_log_index):
+                return {"term": self.current_term, "vote_granted": False}
+            if request["pre_vote"]:
+                return {"term": self.current_term, "vote_granted": True}
+            self.voted_for = request["candidate_id"]
+            self.save_state()
+            self.reset_election_timer()
+            return {"term": self.current_term, "vote_granted": True}
 
     def read_file(self, file_path):
         """
@@ -154,73 +384,1040 @@ class Node:
         
     def update_eventlog(self, event_type, details):
         """
-        Update the event log with various types of events.
+        Record an event in this node's audit log.
+
+        The event is only buffered in memory, subject to its sampling rate; the
+        audit logger writes it out in the background.
 
         Args:
             event_type (str): The type of event (e.g., 'api_invocation', 'heartbeat_sent').
             details (dict): Detailed information about the event.
         """
-        eventlog = self.read_file(f"{self.port}/eventlog.json")
-        eventlog.append({"timestamp": datetime.now().isoformat(), "event_type": event_type, "details": details})
-        self.create_or_update_file(f"{self.port}/eventlog.json", eventlog)
+        self.audit.record(event_type, details)
+
+    async def run_io(self, function, *args):
+        """
+        Run blocking disk access on a worker thread, so the event loop keeps serving requests meanwhile.
+
+        Args:
+            function (callable): The blocking call.
+            *args: Its arguments.
+
+        Returns:
+            The call's return value.
+        """
+        return await asyncio.get_running_loop().run_in_executor(None, function, *args)
+
+    def maybe_snapshot(self):
+        """
+        Snapshot the state machine and compact the logs once a trigger is reached.
+
+        Called from the background heartbeat loops, never from request handlers.
+        """
+        entries = self.store.applied_index - self.snapshot_index
+        log_bytes = self.log.bytes_appended - self.snapshot_log_bytes
+        if entries > 0 and (entries >= self.snapshot_entries or log_bytes >= self.snapshot_bytes):
+            self.take_snapshot()
+
+    def take_snapshot(self):
+        """
+        Write a snapshot of the applied state and drop the log segments it covers.
+        """
+        with self.store.lock:
+            metadata = self.store.to_dict()
+            index = self.store.applied_index
+            term = self.store.applied_term
+        self.snapshot_log_bytes = self.log.bytes_appended
+        self.snapshots.save(metadata, index, term)
+        self.log.truncate_prefix(index)
+        self.snapshot_index = index
+        self.snapshot_term = term
+        print(f"Snapshot taken at log index {index}")
+
+    def term_at(self, index):
+        """
+        Look up the term of a log entry.
+
+        Args:
+            index (int): The log index.
+
+        Returns:
+            int: The entry's term, or None if the entry is neither in the log nor the last one snapshotted.
+        """
+        if index == 0:
+            return 0
+        if index == self.snapshot_index:
+            return self.snapshot_term
+        if index < self.log.first_offset or index > self.log.last_offset:
+            return None
+        return self.log.read(index, 1)[0]["term"]
+
+    def apply_committed(self):
+        """
+        Apply log entries up to the commit index that the state machine has not seen yet.
+        """
+        applied_index = self.store.applied_index
+        if self.commit_index > applied_index:
+            entries = self.read_committed(applied_index + 1, self.commit_index)
+            for entry in entries:
+                self.entry_applied(entry["index"], self.store.apply(entry))
+            self.notify_applied(entries)
+
+    def read_committed(self, start, end):
+        """
+        Read the log entries from start to end inclusive, for applying them.
+
+        Args:
+            start (int): The first index.
+            end (int): The last index.
+
+        Returns:
+            list: The entries, oldest first.
+        """
+        return self.log.read(start, end - start + 1)
+
+    def fetch_changes(self, offset, max_records, expand=True):
+        """
+        Collect the committed log entries after an offset, for brokers catching up on metadata.
+
+        Only entries this node has applied are returned, so a caller never sees a change
+        that could still be rolled back.
+
+        Args:
+            offset (int): Log index of the last entry the caller applied.
+            max_records (int): Upper bound on the number of entries returned, itself capped at max_fetch_records.
+            expand (bool): Split batches into one entry per record.
+
+        Returns:
+            dict: "entries" after offset, batches split into one entry per record unless expand is off, and
+                the new "offset" to fetch from, or, if the
+                entries were compacted into a snapshot, the whole metadata as "snapshot"
+                with the "offset" it covers.
+        """
+        max_records = max(1, min(max_records, self.max_fetch_records))
+        applied_index = self.store.applied_index
+        if offset >= applied_index:
+            return {"offset": offset, "entries": [], "applied_index": applied_index}
+        # Applied entries are never rewritten, so the log is read without holding the store's
+        # lock, which the event loop takes for every write and list read
+        entries = self.log.read(offset + 1, min(max_records, applied_index - offset))
+        # The log may have been compacted past the offset, or between the check and the read
+        if not entries or entries[0]["index"] != offset + 1:
+            with self.store.lock:
+                applied_index = self.store.applied_index
+                snapshot = self.store.to_dict()
+            return {"offset": applied_index, "snapshot": snapshot, "applied_index": applied_index}
+        if expand:
+            # A batch is returned as one entry per record, all with the batch's index
+            entries = [record for entry in entries for record in expand_entry(entry)]
+        return {"offset": entries[-1]["index"], "entries": entries, "applied_index": applied_index}
+
+    def cached_response(self, key, sections, build, if_none_match=None):
+        """
+        Serve a read of whole metadata sections from bytes serialized once per version.
+
+        The ETag is the newest version of the sections read, so a client whose
+        If-None-Match still matches gets 304 without the state being touched.
+
+        Args:
+            key (str): Names the response in the cache and the ETag.
+            sections (list): The SECTIONS the response is built from.
+            build (callable): Builds the response body from the store.
+            if_none_match (str, optional): The request's If-None-Match header.
+
+        Returns:
+            Response: 304 if the client's copy is current, otherwise the JSON body, both with the ETag.
+        """
+        with self.store.lock:
+            version = max(self.store.versions[section] for section in sections)
+            etag = f'"{key}-{version}"'
+            if if_none_match is not None and etag in [tag.strip() for tag in if_none_match.split(",")]:
+                return Response(status_code=304, headers={"ETag": etag})
+            cached = self.response_cache.get(key)
+            if cached is None or cached[0] != version:
+                cached = (version, json.dumps(build(), ensure_ascii=False, separators=(",", ":")).encode())
+                self.response_cache[key] = cached
+        return Response(cached[1], media_type="application/json", headers={"ETag": etag})
+
+    def list_page(self, kind, cursor, limit, fields, **filters):
+        """
+        Read one page of a list endpoint.
+
+        Args:
+            kind (str): "brokers", "topics", "partitions" or "producers".
+            cursor (str, optional): The next_cursor of the previous page.
+            limit (int, optional): Records per page, at most max_page_size.
+            fields (str, optional): Comma-separated record fields to return; all by default.
+            **filters: Indexed attribute values the records must have; None matches anything.
+
+        Returns:
+            dict: The page's "records" and the "next_cursor" to pass for the next page, None
+                after the last one, or a message if the cursor is invalid.
+        """
+        limit = min(limit or self.max_page_size, self.max_page_size)
+        with self.store.lock:
+            try:
+                records, last_key = self.store.page(kind, self.decode_cursor(cursor), limit, **filters)
+            except (ValueError, TypeError):
+                return {"message": "Invalid cursor"}
+            if fields:
+                names = fields.split(",")
+                records = [{name: record[name] for name in names if name in record} for record in records]
+        return {"records": records, "next_cursor": self.encode_cursor(last_key)}
+
+    @staticmethod
+    def encode_cursor(key):
+        """
+        Returns:
+            str: An opaque cursor for the record key, or None for no key.
+        """
+        if key is None:
+            return None
+        return base64.urlsafe_b64encode(json.dumps(key).encode()).decode()
+
+    @staticmethod
+    def decode_cursor(cursor):
+        """
+        Returns:
+            The record key a cursor was made from, or None for no cursor.
+
+        Raises:
+            ValueError: If the cursor was not made by encode_cursor.
+        """
+        if cursor is None:
+            return None
+        key = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        # Producer keys are (brokerId, producerId) tuples, which JSON turns into lists
+        return tuple(key) if isinstance(key, list) else key
+
+    def entry_applied(self, index, result):
+        """
+        Called after each committed entry is applied to the state machine.
+
+        Args:
+            index (int): The log index of the entry.
+            result: What the state machine returned for it.
+        """
+
+    def append_entries(self, request):
+        """
+        Handle an AppendEntries request from the leader.
+
+        Args:
+            request (dict): term, leader_id, prev_log_index, prev_log_term, entries and leader_commit.
+
+        Returns:
+            dict: The current term, whether the entries were accepted, and either the
+                follower's match index or the index the leader should retry from.
+        """
+        with self.log_lock:
+            if request["term"] < self.current_term:
+                return {"term": self.current_term, "success": False, "conflict_index": self.log.last_offset + 1}
+            self.observe_term(request["term"])
+            self.leader_port = request["leader_id"]
+            self.leader_contact = time.monotonic()
+            self.detector(self.leader_port).heartbeat()
+            self.reset_election_timer()
+            prev_log_index = request["prev_log_index"]
+            if prev_log_index > self.log.last_offset and prev_log_index != self.snapshot_index:
+                return {"term": self.current_term, "success": False, "conflict_index": self.log.last_offset + 1}
+            if prev_log_index >= self.snapshot_index and self.term_at(prev_log_index) != request["prev_log_term"]:
+                return {"term": self.current_term, "success": False, "conflict_index": max(prev_log_index, 1)}
+
+            new_entries = []
+            for entry in request["entries"]:
+                if entry["index"] <= self.snapshot_index:
+                    continue
+                if not new_entries and entry["index"] <= self.log.last_offset:
+                    if self.term_at(entry["index"]) == entry["term"]:
+                        continue
+                    self.log.truncate_suffix(entry["index"])
+                if entry["index"] != self.log.last_offset + 1 + len(new_entries):
+                    return {"term": self.current_term, "success": False, "conflict_index": self.log.last_offset + 1}
+                new_entries.append(entry)
+            # One write and at most one fsync for the whole request
+            self.log.append_many(new_entries)
+
+            match_index = prev_log_index + len(request["entries"])
+            if request["leader_commit"] > self.commit_index:
+                self.commit_index = min(request["leader_commit"], match_index)
+            self.apply_committed()
+            return {"term": self.current_term, "success": True, "match_index": match_index}
+
+    def install_snapshot(self, request):
+        """
+        Replace the local state and log with a snapshot sent by the leader.
+
+        Args:
+            request (dict): term, leader_id, last_included_index, last_included_term and metadata.
+
+        Returns:
+            dict: The current term and the index the follower now matches.
+        """
+        with self.log_lock:
+            if request["term"] < self.current_term:
+                return {"term": self.current_term, "success": False, "match_index": 0}
+            self.observe_term(request["term"])
+            self.leader_port = request["leader_id"]
+            self.leader_contact = time.monotonic()
+            self.detector(self.leader_port).heartbeat()
+            self.reset_election_timer()
+            index = request["last_included_index"]
+            term = request["last_included_term"]
+            self.snapshots.save(request["metadata"], index, term)
+            self.store.restore(request["metadata"], index, term)
+            self.log.reset(index + 1)
+            self.snapshot_index = index
+            self.snapshot_term = term
+            self.snapshot_log_bytes = self.log.bytes_appended
+            self.commit_index = index
+            self.notify_applied(snapshot_installed=True)
+            print(f"Installed snapshot at log index {index}")
+            return {"term": self.current_term, "success": True, "match_index": index}
+
+    def notify_applied(self, entries=(), snapshot_installed=False):
+        """
+        Wake the reads whose read index the state machine has now reached and pass
+        the applied entries to stream subscribers. Safe to call from any thread.
+
+        Args:
+            entries (list): The entries just applied, in index order.
+            snapshot_installed (bool): The state jumped to a snapshot, so subscribers
+                cannot be sent the entries in between and are disconnected.
+        """
+        if Node.loop is not None:
+            Node.loop.call_soon_threadsafe(self.release_applied_waiters)
+            Node.loop.call_soon_threadsafe(self.publish_applied, entries, snapshot_installed)
+
+    def publish_applied(self, entries, snapshot_installed):
+        for subscriber in self.subscribers:
+            if snapshot_installed:
+                subscriber.close("Snapshot installed")
+            else:
+                subscriber.publish(entries)
+
+    def release_applied_waiters(self):
+        applied_index = self.store.applied_index
+        while self.applied_waiters and self.applied_waiters[0][0] <= applied_index:
+            _index, _seq, future = heapq.heappop(self.applied_waiters)
+            if not future.done():
+                future.set_result(True)
+
+    async def wait_applied(self, index, timeout=None):
+        """
+        Wait until the state machine has applied a log index.
+
+        Waiters are futures on the event loop, so any number of them can wait without a thread each.
+
+        Args:
+            index (int): The log index to wait for.
+            timeout (float, optional): Seconds to wait, commit_timeout by default.
+
+        Returns:
+            bool: True once the index is applied, False if it was not within the timeout.
+        """
+        if self.store.applied_index >= index:
+            return True
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self.applied_waiters, (index, next(self.waiter_seq), future))
+        # The index may have been applied between the check above and registering the waiter
+        self.release_applied_waiters()
+        try:
+            return await asyncio.wait_for(future, self.commit_timeout if timeout is None else timeout)
+        except asyncio.TimeoutError:
+            return False
+
+    async def watch(self, offset, timeout, kinds, topic_uuid=None):
+        """
+        Wait for committed changes after an offset that match a filter.
+
+        Args:
+            offset (int): Log index of the last entry the caller applied.
+            timeout (float): Seconds to wait for a matching change.
+            kinds (list): Kinds of records to watch, keys of WATCH_KINDS; empty for all.
+            topic_uuid (str, optional): Only partition changes of this topic.
+
+        Returns:
+            dict: Like fetch_changes, with only the matching entries. Entries is empty if
+                nothing matched before the timeout; offset still moves past what was skipped.
+        """
+        types = [record_type for kind in (kinds or WATCH_KINDS) for record_type in WATCH_KINDS[kind]]
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while True:
+            changes = await self.run_io(self.fetch_changes, offset, self.max_append_entries)
+            if "snapshot" in changes:
+                return changes
+            changes["entries"] = [
+                entry for entry in changes["entries"]
+                if entry["type"] in types and (topic_uuid is None or entry["type"] not in (PARTITION, REMOVE_PARTITION) or entry["data"].get("topicUUID") == topic_uuid)
+            ]
+            offset = changes["offset"]
+            if changes["entries"]:
+                return changes
+            if changes["applied_index"] > offset:
+                continue
+            remaining = deadline - loop.time()
+            if remaining <= 0 or not await self.wait_applied(offset + 1, remaining):
+                return changes
+
+    async def stream_changes(self, offset, position=None):
+        """
+        Generate server-sent events for the committed entries after an offset, then for each entry as it is applied.
+
+        Args:
+            offset (int): Log index of the last entry the client applied.
+            position (int, optional): If the client stopped partway through the batch at offset,
+                the position in it of the last record it received.
+
+        Yields:
+            str: One event per metadata record, with the log index as its id, followed by the
+                position for records of a batch. A client behind the start of the log first
+                gets a "snapshot" event. The stream ends with an "error" event if the client
+                falls too far behind.
+        """
+        # The rest of a partly received batch is sent first
+        resume_index, resume_after = offset, -1
+        if position is not None:
+            offset, resume_after = offset - 1, position
+        subscriber = Subscriber(self.stream_buffer)
+        # Subscribe before catching up, so no entry applied in between is missed
+        self.subscribers.add(subscriber)
+        try:
+            while True:
+                changes = await self.run_io(self.fetch_changes, offset, self.max_append_entries, False)
+                if "snapshot" in changes:
+                    yield format_event(changes["offset"], "snapshot", changes["snapshot"])
+                for entry in changes.get("entries", []):
+                    for event in entry_events(entry, resume_after if entry["index"] == resume_index else -1):
+                        yield event
+                offset = changes["offset"]
+                if changes["applied_index"] <= offset:
+                    break
+            while True:
+                entry = await subscriber.queue.get()
+                if subscriber.closed is not None:
+                    yield format_event(offset, "error", {"message": subscriber.closed})
+                    return
+                if entry["index"] > offset:
+                    offset = entry["index"]
+                    for event in entry_events(entry, resume_after if entry["index"] == resume_index else -1):
+                        yield event
+        finally:
+            self.subscribers.discard(subscriber)
+
+    async def get_read_index(self):
+        """
+        Find the commit index a linearizable read must observe.
+
+        Returns:
+            int: The read index, or None if it cannot be established.
+        """
+        return None
+
+    async def read_barrier(self, stale=False):
+        """
+        Wait until this node's state is fresh enough to serve a read.
+
+        A linearizable read takes the leader's commit index once the leader has
+        confirmed it still leads, then waits until this node has applied up to
+        it. A stale read is served from whatever this node has applied.
+
+        Args:
+            stale (bool): Skip the read index and serve local state as is.
+
+        Returns:
+            bool: True if the read can be served.
+        """
+        if stale:
+            return True
+        read_index = await self.get_read_index()
+        if read_index is None:
+            return False
+        return await self.wait_applied(read_index)
+
+    def stop(self):
+        """
+        Stop the background work of this role before the node changes role.
+        """
+
+    def cluster_size(self):
+        """
+        Returns:
+            int: The number of voting nodes, this one included.
+        """
+        return len([port for port in self.config["follower_nodes"] if int(port) != self.port]) + 1
+
+    def sync_logs(self):
+        """
+        Flush pending appends of the log to disk under the "interval" fsync policy.
+        """
+        self.log.sync()
 # Define the Leader class, inheriting from Node
 class Leader(Node):
-    def __init__(self, port):
-        super().__init__(port)
-        threading.Thread(target=self.heartbeat_task, daemon=True).start()
-
-    # def send_heartbeat(self, follower_port):
-    #     """
-    #     Send a heartbeat to a follower.
-
-    #     Args:
-    #         follower_port (int): The port of the follower node.
-    #     """
-    #     metadata = self.read_file(f"{self.port}/metadata.json")
-    #     try:
-    #         response = requests.post(f"http://localhost:{follower_port}/heartbeat", json=metadata)
-    #         print(f"Heartbeat acknowledged by follower on port {follower_port}: {response.json()}")
-    #         self.update_eventlog("sent", follower_port)
-    #     except requests.RequestException:
-    #         print(f"Failed to send heartbeat to follower on port {follower_port}")
-    def send_heartbeat(self, follower_port):
-        """
-        Send a heartbeat to a follower, including the event log.
-        """
-        metadata = self.read_file(f"{self.port}/metadata.json")
-        eventlog = self.read_file(f"{self.port}/eventlog.json")
-        heartbeat_payload = {"metadata": metadata, "eventlog": eventlog}
+    def __init__(self, port, previous=None):
+        super().__init__(port, previous)
+        # Raft replication state: next log index to send and highest index known replicated, per follower
+        self.next_index = {}
+        self.match_index = {}
+        # Futures of client writes waiting for their entry to commit, by log index
+        self.pending = {}
+        # Results of entries applied before their group's append returned, by log index: the
+        # fsync runs outside the log lock, so followers can store and acknowledge a group first
+        self.unclaimed = {}
+        # Group commit: proposals gathered for up to group_commit_window seconds or
+        # group_commit_max proposals are appended, fsynced and replicated together
+        self.proposals = []
+        self.flush_handle = None
+        # The group being appended by the disk thread; proposals arriving meanwhile form the next group
+        self.flushing = None
+        self.group_commit_window = self.config.get("group_commit_window", 0.002)
+        self.group_commit_max = self.config.get("group_commit_max", 256)
+        # Followers whose last AppendEntries failed, so failures are reported once
+        self.unreachable = set()
+        # Loop time at which the newest acknowledged AppendEntries was sent, per follower
+        self.ack_sent_at = {}
+        # The follower leadership is being handed to, with futures set once it holds the whole
+        # log and once this node has stepped down; proposals are refused meanwhile
+        self.transfer_target = None
+        self.transfer_caught_up = None
+        self.stepped_down = None
+        # Set under log_lock on stepping down, after which nothing more is appended to the log
+        self.deposed = False
+        # Reads waiting for a majority to confirm leadership, as (started, future)
+        self.ack_waiters = []
+        # Serve reads without a heartbeat round while the last majority acknowledgement
+        # is younger than the minimum election timeout, shortened by the clock drift bound
+        self.lease_reads = self.config.get("lease_reads", False)
+        self.lease_clock_drift = self.config.get("lease_clock_drift", 0.1)
+        # Loop time at which the last leadership transfer ended; only acknowledgements of
+        # requests sent after it count towards a lease
+        self.lease_fence = float("-inf")
+        self.replicator = ReplicationScheduler(
+            self, self.heartbeat_interval, max_in_flight=self.config.get("max_inflight_rpcs", 64)
+        )
+        # Entries this leader appended, by index, kept until applied so committing needs no log read
+        self.appended = {}
+        # Producer ID blocks allocated by the whole log, applied or not; the next block starts after them
+        self.producer_blocks_logged = self.count_producer_blocks()
+        # Entries from earlier terms only commit once an entry of this term does
+        self.term_start_index = self.append_entry(NO_OP, {})
+        # Highest index written to this node's log, fsynced under the "always" policy;
+        # the leader counts towards a majority only up to here
+        self.stored_index = self.log.last_offset
+        self.advance_commit_index()
+        if Node.loop is not None:
+            Node.loop.call_soon_threadsafe(self.replicator.start)
+
+    def stop(self):
+        # Called with log_lock held, so no append of this leader can start afterwards
+        self.deposed = True
+        if Node.loop is not None:
+            Node.loop.call_soon_threadsafe(self.replicator.stop)
+            Node.loop.call_soon_threadsafe(self.fail_pending)
+
+    def fail_pending(self):
+        """
+        Answer every waiting write with the not-leader message after losing leadership.
+        """
+        if self.flush_handle is not None:
+            self.flush_handle.cancel()
+            self.flush_handle = None
+        futures = list(self.pending.values()) + [proposal[2] for proposal in self.proposals + (self.flushing or [])]
+        for future in futures:
+            if not future.done():
+                future.set_result({"message": "Not a leader node"})
+        self.pending.clear()
+        self.unclaimed.clear()
+        self.proposals.clear()
+        self.flushing = None
+        if self.stepped_down is not None and not self.stepped_down.done():
+            self.stepped_down.set_result(True)
+
+    def append_entry(self, record_type, data):
+        """
+        Append a metadata record to the leader's log without committing it.
+
+        Args:
+            record_type (str): The log entry type, e.g. "TopicRecord".
+            data (dict): The record payload, including any generated UUIDs.
+
+        Returns:
+            int: The log index of the new entry.
+        """
+        return self.append_entries_batch([(record_type, data)])[0]
+
+    def append_entries_batch(self, records):
+        """
+        Append several metadata records to the leader's log with one write and at most one fsync.
+
+        Args:
+            records (list): (record_type, data) pairs, in order.
+
+        Returns:
+            list: The log index of each new entry, or None if this node has stepped down.
+        """
+        with self.log_lock:
+            # A group proposed before stepping down must not reach the log under the newer term
+            if self.deposed:
+                return None
+            # Producer ID ranges are assigned in log order, so concurrent allocations never
+            # overlap and the entry itself tells brokers following the log their range
+            records = list(records)
+            producer_blocks = self.producer_blocks_logged
+            for position, (record_type, data) in enumerate(records):
+                if record_type == PRODUCER_ID_BLOCK:
+                    first = producer_blocks * PRODUCER_ID_BLOCK_SIZE
+                    records[position] = (record_type, {**data, "firstProducerId": first, "lastProducerId": first + PRODUCER_ID_BLOCK_SIZE - 1})
+                    producer_blocks += 1
+            timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            next_index = self.log.last_offset + 1
+            entries = [
+                {"index": next_index + position, "term": self.current_term, "type": record_type, "timestamp": timestamp, "data": data}
+                for position, (record_type, data) in enumerate(records)
+            ]
+            indexes = self.log.append_many(entries)
+            self.producer_blocks_logged = producer_blocks
+            for entry in entries:
+                self.appended[entry["index"]] = entry
+            return indexes
+
+    def count_producer_blocks(self):
+        """
+        Count the producer ID blocks allocated by this node's log, including entries not yet applied.
+
+        Returns:
+            int: The number of blocks.
+        """
+        with self.log_lock, self.store.lock:
+            start = self.store.applied_index + 1
+            applied_blocks = len(self.store.producer_blocks)
+            entries = self.log.read(start, self.log.last_offset - start + 1) if start <= self.log.last_offset else []
+        return applied_blocks + sum(1 for entry in entries for record in expand_entry(entry) if record["type"] == PRODUCER_ID_BLOCK)
+
+    async def commit(self, record_type, data):
+        """
+        Propose a metadata record and wait until a majority has stored it.
+
+        Proposals arriving close together are appended and replicated as a group.
+
+        Args:
+            record_type (str): The log entry type, e.g. "TopicRecord".
+            data (dict): The record payload, including any generated UUIDs.
+
+        Returns:
+            The result of applying the record to the metadata store, or a message
+            if no majority acknowledged it within commit_timeout seconds.
+        """
+        if self.transfer_target is not None:
+            return {"message": "Leadership transfer in progress"}
+        loop = asyncio.get_running_loop()
+        proposal = [record_type, data, loop.create_future(), None]
+        self.proposals.append(proposal)
+        if len(self.proposals) >= self.group_commit_max:
+            self.flush_proposals()
+        elif self.flush_handle is None:
+            self.flush_handle = loop.call_later(self.group_commit_window, self.flush_proposals)
+        try:
+            return await asyncio.wait_for(asyncio.shield(proposal[2]), self.commit_timeout)
+        except asyncio.TimeoutError:
+            return {"message": f"Entry {proposal[3]} not yet committed by a majority"}
+
+    def flush_proposals(self):
+        """
+        Hand the gathered proposals to the disk thread as one group, unless a group is
+        still being appended; the next group starts as soon as that one is stored.
+        """
+        if self.flush_handle is not None:
+            self.flush_handle.cancel()
+            self.flush_handle = None
+        if self.flushing is not None or not self.proposals:
+            return
+        self.flushing, self.proposals = self.proposals, []
+        asyncio.ensure_future(self.write_proposals(self.flushing))
+
+    async def write_proposals(self, proposals):
+        """
+        Append a group of proposals on the disk thread, then count them towards a majority and replicate them.
+
+        Args:
+            proposals (list): The proposals of the group, as [record_type, data, future, index].
+        """
+        message = "Not a leader node"
+        try:
+            indexes = await asyncio.get_running_loop().run_in_executor(
+                self.disk, self.append_entries_batch, [(record_type, data) for record_type, data, _future, _index in proposals]
+            )
+        except Exception as error:
+            print(f"Failed to append to the log: {error!r}")
+            indexes = None
+            message = "Failed to append to the log"
+        if self.flushing is not proposals:
+            # Leadership was lost while appending and fail_pending already answered the group
+            return
+        self.flushing = None
+        if indexes is None:
+            for proposal in proposals:
+                if not proposal[2].done():
+                    proposal[2].set_result({"message": message})
+        else:
+            applied_index = self.store.applied_index
+            for index, proposal in zip(indexes, proposals):
+                proposal[3] = index
+                if index in self.unclaimed:
+                    proposal[2].set_result(self.unclaimed.pop(index))
+                else:
+                    self.pending[index] = proposal[2]
+                if index <= applied_index:
+                    # Applied from the log before the disk thread recorded the entry
+                    self.appended.pop(index, None)
+            self.unclaimed.clear()
+            self.stored_index = max(self.stored_index, indexes[-1])
+            self.advance_commit_index()
+            self.replicator.wake_all()
+        if self.proposals:
+            self.flush_proposals()
+
+    async def transfer_leadership(self, follower_port=None):
+        """
+        Hand leadership to a follower, pausing writes for about one RPC round.
+
+        New proposals are refused from the start. Once the follower holds every entry of
+        this leader's log it is sent TimeoutNow and stands for election straight away,
+        skipping its election timer and the pre-vote, which its log wins. If the follower
+        does not catch up, or is not elected within an election timeout, this node goes on leading.
+
+        Args:
+            follower_port (int, optional): The follower to hand over to; the most up to date one if omitted.
+
+        Returns:
+            dict: A message saying whether leadership was handed over, and to which port.
+        """
+        if self.transfer_target is not None:
+            return {"message": "Leadership transfer in progress"}
+        followers = [port for port in self.config["follower_nodes"] if int(port) != self.port]
+        if follower_port is None and followers:
+            follower_port = max(followers, key=lambda port: self.match_index.get(port, 0))
+        if follower_port not in followers:
+            return {"message": f"No follower on port {follower_port}"}
+        loop = asyncio.get_running_loop()
+        self.transfer_target = follower_port
+        self.transfer_caught_up = loop.create_future()
+        self.stepped_down = loop.create_future()
+        try:
+            self.check_transfer()
+            self.replicator.add_follower(follower_port)
+            try:
+                await asyncio.wait_for(asyncio.shield(self.transfer_caught_up), self.election_timeout_max)
+            except asyncio.TimeoutError:
+                return {"message": f"Follower on port {follower_port} did not catch up"}
+            try:
+                response = (await self.peers.get_async(follower_port).post(
+                    "/timeout_now", json={"term": self.current_term, "leader_id": self.port}
+                )).json()
+            except RPCError:
+                return {"message": f"Failed to reach follower on port {follower_port}"}
+            if not response["success"]:
+                return {"message": f"Follower on port {follower_port} refused TimeoutNow in term {response['term']}"}
+            # Writes stay refused until the follower's RequestVote deposes this leader
+            try:
+                await asyncio.wait_for(asyncio.shield(self.stepped_down), self.election_timeout_max)
+            except asyncio.TimeoutError:
+                return {"message": f"Follower on port {follower_port} was not elected"}
+            print(f"Handed leadership to follower on port {follower_port}")
+            return {"message": "Leadership transferred", "leader": follower_port}
+        finally:
+            self.transfer_target = None
+            self.transfer_caught_up = None
+            # The follower may still be standing on the TimeoutNow; acknowledgements from before now prove nothing
+            self.lease_fence = loop.time()
+
+    def check_transfer(self):
+        """
+        Let a leadership transfer go ahead once its follower holds every entry and no proposal is still being appended.
+        """
+        caught_up = self.transfer_caught_up
+        if (
+            caught_up is not None
+            and not caught_up.done()
+            and not self.proposals
+            and self.flushing is None
+            and self.match_index.get(self.transfer_target, 0) >= self.log.last_offset
+        ):
+            caught_up.set_result(True)
+
+    def advance_commit_index(self):
+        """
+        Move the commit index to the highest entry of this term stored on a majority, and apply up to it.
+        """
+        match = sorted(
+            [self.stored_index] + [self.match_index.get(port, 0) for port in self.config["follower_nodes"] if int(port) != self.port],
+            reverse=True,
+        )
+        majority_index = match[self.cluster_size() // 2]
+        if majority_index > self.commit_index and majority_index >= self.term_start_index:
+            self.commit_index = majority_index
+            self.apply_committed()
+            # Tell followers straight away so their reads and watches see the entry
+            self.replicator.wake_all()
+
+    async def commit_batch(self, results, records):
+        """
+        Commit new records as one log entry, so they are applied together or not at all.
+
+        Args:
+            results (list): Per requested item, its result if it needs no write, otherwise None.
+            records (list): (position, record_type, data) for each item to write, position indexing results.
+
+        Returns:
+            dict: "results" with the applied result of each written record filled in, or a
+                message if no majority acknowledged the entry within commit_timeout seconds.
+        """
+        if records:
+            applied = await self.commit(BATCH, {"records": [{"type": record_type, "data": data} for _, record_type, data in records]})
+            if not isinstance(applied, list):
+                return applied
+            for (position, _record_type, _data), result in zip(records, applied):
+                results[position] = result
+        return {"results": results}
+
+    def read_committed(self, start, end):
+        """
+        Take the entries from start to end from the ones this leader appended, so
+        commits on the event loop never read the disk. Entries of earlier terms,
+        committed once after taking over, are read from the log.
+        """
+        indexes = range(start, end + 1)
+        if all(index in self.appended for index in indexes):
+            return [self.appended.pop(index) for index in indexes]
+        for index in indexes:
+            self.appended.pop(index, None)
+        return self.log.read(start, end - start + 1)
+
+    def entry_applied(self, index, result):
+        future = self.pending.pop(index, None)
+        if future is None:
+            if index > self.stored_index:
+                # Committed by the followers while this node's append of the group is still running
+                self.unclaimed[index] = result
+        elif not future.done():
+            future.set_result(result)
+
+    async def get_read_index(self):
+        """
+        Take the commit index as the read index and confirm leadership with a majority.
+
+        Returns:
+            int: The read index, or None before this term's first entry commits or
+                if a majority did not answer within commit_timeout seconds.
+        """
+        if self.commit_index < self.term_start_index:
+            return None
+        read_index = self.commit_index
+        if self.lease_reads and self.lease_valid():
+            return read_index
+        if not await self.confirm_leadership():
+            return None
+        return read_index
+
+    def lease_valid(self):
+        """
+        Check whether the leader lease still covers this moment.
+
+        The lease starts when the oldest request of the latest majority of acknowledgements
+        was sent. No follower starts an election until at least election_timeout_min has
+        passed since it last heard from the leader, so no other leader can exist before then.
+        A leadership transfer breaks that promise, since TimeoutNow makes the follower stand
+        at once, so there is no lease from the start of a transfer until it is abandoned.
+
+        Returns:
+            bool: True if reads may be served without confirming leadership.
+        """
+        if self.transfer_target is not None:
+            return False
+        needed = self.cluster_size() // 2
+        if needed == 0:
+            return True
+        acks = sorted(
+            [self.ack_sent_at[port] for port in self.config["follower_nodes"] if int(port) != self.port and port in self.ack_sent_at],
+            reverse=True,
+        )
+        if len(acks) < needed or acks[needed - 1] <= self.lease_fence:
+            return False
+        lease_expiry = acks[needed - 1] + self.election_timeout_min * (1 - self.lease_clock_drift)
+        return asyncio.get_running_loop().time() < lease_expiry
+
+    async def confirm_leadership(self):
+        """
+        Send a heartbeat round and wait until a majority has answered one sent after this call.
+
+        Concurrent calls share the same heartbeat rounds.
+
+        Returns:
+            bool: True if a majority acknowledged this leader within commit_timeout seconds.
+        """
+        if self.cluster_size() // 2 == 0:
+            return True
+        loop = asyncio.get_running_loop()
+        waiter = (loop.time(), loop.create_future())
+        self.ack_waiters.append(waiter)
+        self.replicator.wake_all()
         try:
-            response = requests.post(f"http://localhost:{follower_port}/heartbeat", json=heartbeat_payload)
-            print(f"Heartbeat acknowledged by follower on port {follower_port}: {response.json()}")
+            return await asyncio.wait_for(waiter[1], self.commit_timeout)
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            self.ack_waiters.remove(waiter)
+
+    def record_ack(self, follower_port, sent_at):
+        """
+        Note that a follower accepted this leader's term for a request sent at sent_at.
+
+        Args:
+            follower_port (int): The port of the follower node.
+            sent_at (float): Event loop time at which the request was sent.
+        """
+        self.ack_sent_at[follower_port] = max(sent_at, self.ack_sent_at.get(follower_port, sent_at))
+        self.detector(follower_port).heartbeat()
+        needed = self.cluster_size() // 2
+        for started, future in self.ack_waiters:
+            acks = sum(1 for acked_at in self.ack_sent_at.values() if acked_at >= started)
+            if acks >= needed and not future.done():
+                future.set_result(True)
+
+    async def send_heartbeat(self, follower_port):
+        """
+        Send an AppendEntries request to a follower.
+
+        Carries only the log entries the follower is missing, so a caught-up follower
+        gets an empty heartbeat. A follower that needs entries already compacted
+        away is sent the state as a snapshot instead.
+
+        Args:
+            follower_port (int): The port of the follower node.
+
+        Returns:
+            bool: True if the follower is still missing entries after this request.
+        """
+        next_index = self.next_index.setdefault(follower_port, self.log.last_offset + 1)
+        prev_log_term, entries = await self.run_io(self.read_for_follower, next_index)
+        if prev_log_term is None or next_index < self.log.first_offset:
+            return await self.send_snapshot(follower_port)
+
+        heartbeat_payload = {
+            "term": self.current_term,
+            "leader_id": self.port,
+            "prev_log_index": next_index - 1,
+            "prev_log_term": prev_log_term,
+            "entries": entries,
+            "leader_commit": self.commit_index,
+        }
+        try:
+            sent_at = asyncio.get_running_loop().time()
+            response = (await self.peers.get_async(follower_port).post("/heartbeat", json=heartbeat_payload)).json()
+            if entries:
+                print(f"Heartbeat acknowledged by follower on port {follower_port}: {response}")
+            self.unreachable.discard(follower_port)
+            if response["term"] > self.current_term:
+                await self.run_io(self.adopt_term, response["term"])
+                return False
+            self.record_ack(follower_port, sent_at)
+            if response["success"]:
+                self.match_index[follower_port] = response["match_index"]
+                self.next_index[follower_port] = response["match_index"] + 1
+                self.advance_commit_index()
+                self.check_transfer()
+            else:
+                self.next_index[follower_port] = max(1, min(next_index - 1, response["conflict_index"]))
             self.update_eventlog("heartbeat_sent", {"follower_port": follower_port})
-        except requests.RequestException:
-            print(f"Failed to send heartbeat to follower on port {follower_port}")
+        except RPCError:
+            # Heartbeats go out every few tens of milliseconds, so only the first failure is reported
+            if follower_port not in self.unreachable:
+                print(f"Failed to send heartbeat to follower on port {follower_port}")
+                self.unreachable.add(follower_port)
+            return False
+        return self.next_index[follower_port] <= self.log.last_offset
+
+    def read_for_follower(self, next_index):
+        """
+        Read what an AppendEntries request to a follower carries. Blocking; run through run_io.
 
-    def heartbeat_task(self):
+        Args:
+            next_index (int): The first log index the follower is missing.
+
+        Returns:
+            tuple: (prev_log_term, entries), prev_log_term None if the entry
+                before next_index was compacted away.
         """
-        Periodically send heartbeats to all follower nodes.
+        prev_log_term = self.term_at(next_index - 1)
+        if prev_log_term is None:
+            return None, []
+        return prev_log_term, self.log.read(next_index, self.max_append_entries)
+
+    async def send_snapshot(self, follower_port):
         """
-        while True:
-            threads = []
-            for follower_port in self.config["follower_nodes"]:
-                thread = threading.Thread(target=self.send_heartbeat, args=(follower_port,))
-                thread.start()
-                threads.append(thread)
+        Send the current state to a follower that is behind the start of the log.
 
-            for thread in threads:
-                thread.join()
+        Args:
+            follower_port (int): The port of the follower node.
 
-            time.sleep(self.heartbeat_interval)
+        Returns:
+            bool: True if the follower is still missing entries after the snapshot.
+        """
+        with self.store.lock:
+            snapshot_payload = {
+                "term": self.current_term,
+                "leader_id": self.port,
+                "last_included_index": self.store.applied_index,
+                "last_included_term": self.store.applied_term,
+                "metadata": self.store.to_dict(),
+            }
+        try:
+            response = (await self.peers.get_async(follower_port).post("/install_snapshot", json=snapshot_payload)).json()
+            print(f"Snapshot installed by follower on port {follower_port}: {response['match_index']}")
+            if response["term"] > self.current_term:
+                await self.run_io(self.adopt_term, response["term"])
+                return False
+            if response["success"]:
+                self.match_index[follower_port] = response["match_index"]
+                self.next_index[follower_port] = response["match_index"] + 1
+                self.advance_commit_index()
+                self.check_transfer()
+        except RPCError:
+            print(f"Failed to send snapshot to follower on port {follower_port}")
+            return False
+        return self.next_index.get(follower_port, 0) <= self.log.last_offset
 
 # Define the Follower class, inheriting from Node
 class Follower(Node):
-    def __init__(self, port, leader_port):
-        super().__init__(port)
-        self.register_with_leader(leader_port)
-        self.ack_lock = threading.Lock()
-        self.acknowledgements = 0
-        threading.Thread(target=self.monitor_heartbeat, daemon=True).start()
+    def __init__(self, port, leader_port, previous=None):
+        super().__init__(port, previous)
+        # The leader of the current term, or None until one is heard from
+        self.leader_port = leader_port
+        self.running = True
+        self.maintenance_timer = None
+        self.maintenance_interval = 1.0
+        if previous is None and leader_port is not None:
+            self.register_with_leader(leader_port)
+        # Before the server accepts heartbeats the election timer would only run out, so the
+        # startup hook starts it instead
+        if Node.loop is not None:
+            self.start_timers()
+
+    def start_timers(self):
+        """
+        Arm the election timer and the maintenance timer on the event loop. Safe to call from any thread.
+        """
+        self.election_timer = Timer(Node.loop, self.election_timeout)
+        self.maintenance_timer = Timer(Node.loop, self.maintenance_due)
+        self.reset_election_timer()
+        self.maintenance_timer.reset(self.maintenance_interval)
+
+    def stop(self):
+        self.running = False
+        if self.election_timer is not None:
+            self.election_timer.cancel()
+            self.maintenance_timer.cancel()
 
     def register_with_leader(self, leader_port):
         """
@@ -229,112 +1426,220 @@ class Follower(Node):
         Args:
             leader_port (int): The port of the leader node.
         """
-        url = f"http://localhost:{leader_port}/register_follower"
-        response = requests.post(url, json={"follower_port": self.port})
+        try:
+            response = self.peers.get(leader_port).post("/register_follower", json={"follower_port": self.port})
+        except RPCError:
+            print(f"Failed to reach leader on port {leader_port} for registration")
+            return
         if response.status_code != 200:
             print(f"Error registering with leader: {response.content}")
-            
 
-    def send_request_to_followers(self):
-        threads = []
-        config = self.read_config("config.json")
-        total_followers = len(config["follower_nodes"])
+    async def get_read_index(self):
+        """
+        Ask the leader for the read index.
 
-        for follower_port in config["follower_nodes"]:
-            thread = threading.Thread(target=self.send_request_to_follower, args=(follower_port,))
-            thread.start()
-            threads.append(thread)
+        Returns:
+            int: The leader's read index, or None if no leader is known, it could not be reached or could not confirm it.
+        """
+        if self.leader_port is None:
+            return None
+        try:
+            response = await self.peers.get_async(self.leader_port).post("/read_index")
+        except RPCError:
+            print(f"Failed to reach leader on port {self.leader_port} for a read index")
+            return None
+        return response.json().get("read_index")
 
-        for thread in threads:
-            thread.join()
+    def timeout_now(self, request):
+        """
+        Handle a TimeoutNow request: the leader hands over leadership, so stand for election at once.
 
-        return total_followers, self.acknowledgements
+        Args:
+            request (dict): The leader's term and port.
 
-    def send_request_to_follower(self, follower_port):
-        url = f"http://localhost:{follower_port}/set_leader/{self.port}"
-        response = requests.post(url)
-        if response.status_code == 200:
-            with self.ack_lock:
-                print(f"Vote received from {follower_port}")
-                self.acknowledgements += 1
-        else:
-            print(f"did not receive vote from {follower_port}")
-            print(f"Error registering with leader: {response.content}")
-            self.achnowledgements += 0
+        Returns:
+            dict: The current term and whether an election was started.
+        """
+        with self.log_lock:
+            if request["term"] != self.current_term or request["leader_id"] != self.leader_port:
+                return {"term": self.current_term, "success": False}
+        threading.Thread(target=self.start_election, args=(False,), daemon=True).start()
+        return {"term": self.current_term, "success": True}
 
-    def monitor_heartbeat(self):
+    def election_timeout(self):
         """
-        Monitor the leader's heartbeat and check for leader failure.
+        Start an election on a worker thread once the election timeout passes without an
+        AppendEntries from the current leader or a vote granted by this node.
         """
-        while True:
-            time.sleep(1)
-            if self.last_heartbeat_time and datetime.now() - self.last_heartbeat_time > timedelta(seconds=self.timeout):
-                print("Leader is dead")
-                config = self.read_config("config.json")
-                config["term"] += 1
-                self.write_config("config.json", config)
-                break
-        self.initiate_leader_election()
-
-    def initiate_leader_election(self):
-        global node  # Reference the global node variable
+        Node.loop.run_in_executor(None, self.start_election)
 
-        config = self.read_config("config.json")
-        config["is_election"] = True
-        self.write_config("config.json", config)
+    def maintenance_due(self):
+        Node.loop.run_in_executor(None, self.run_maintenance)
 
-        random_shutdown_delay = random.randint(1, 10)  # Random delay between 1 to 10 seconds
-        print(f"Becoming candidate in {random_shutdown_delay} seconds...")
-        time.sleep(random_shutdown_delay)
+    def run_maintenance(self):
+        """
+        Snapshot and fsync, then arm the timer for the next round, as the leader's replication scheduler does.
+        """
+        self.maybe_snapshot()
+        self.sync_logs()
+        if self.running:
+            self.maintenance_timer.reset(self.maintenance_interval)
 
-        config = self.read_config("config.json")
-        if config["is_election"]:
-            config["is_election"] = False
-            self.write_config("config.json", config)
-            print("I am a candidate now")
-            config["leader_node"] = None
-            # Remove the leader node port from the follower nodes
-            config["follower_nodes"] = [p for p in config["follower_nodes"] if int(p) != self.port]
+    def start_election(self, pre_vote=True):
+        """
+        Stand for election: move to the next term, vote for this node and ask every other
+        member for its vote. On a majority this node becomes leader; otherwise the election
+        timer runs again and a later term gets a new election. With pre_vote on, the term only
+        moves once a pre-vote round shows that a majority would vote for this node, so a node
+        cut off from the cluster cannot come back with a higher term and depose a healthy leader.
+
+        Args:
+            pre_vote (bool): Whether to hold the configured pre-vote round; a leadership transfer skips it.
+        """
+        global node
+        peers = self.member_ports()
+        if pre_vote and self.pre_vote and not self.win_pre_vote(peers):
+            return
+        with self.log_lock:
+            # The timer may have fired just as this node changed role
+            if not self.running:
+                return
+            self.current_term += 1
+            self.voted_for = self.port
+            self.save_state()
+            self.leader_port = None
+            self.reset_election_timer()
+            last_log_index = self.log.last_offset
+            vote_request = {
+                "term": self.current_term,
+                "candidate_id": self.port,
+                "last_log_index": last_log_index,
+                "last_log_term": self.term_at(last_log_index),
+                "pre_vote": False,
+            }
+        print(f"Starting an election in term {vote_request['term']}")
+        votes = 1 + self.request_votes(peers, vote_request)
+        with self.log_lock:
+            # A newer term or a leader of this term may have been heard from meanwhile
+            if not self.running or self.current_term != vote_request["term"] or self.leader_port is not None:
+                return
+            if 2 * votes <= len(peers) + 1:
+                print(f"Lost the election in term {vote_request['term']} with {votes} of {len(peers) + 1} votes")
+                return
+            print(f"Won the election in term {vote_request['term']} with {votes} of {len(peers) + 1} votes")
+            config = self.read_config("config.json")
+            config["leader_node"] = self.port
+            config["follower_nodes"] = peers
             self.write_config("config.json", config)
-            #send request to all followers to vote for simultaneously using threads
-            print("Sending request to all followers to vote for me")
-            total_followers, acknowledgements= self.send_request_to_followers()
-            print("total followers", total_followers)
-            print("acknowledgements", acknowledgements)
-            if acknowledgements >= total_followers/2:
-                print("I am a leader now")
-                config["is_election"] = False
-                config["leader_node"] = self.port
-                self.write_config("config.json", config)
-                node = Leader(self.port)
-            else:
-                self.initiate_leader_election()
+            node = Leader(self.port, previous=self)
+
+    def win_pre_vote(self, peers):
+        """
+        Ask every other member whether it would vote for this node in the next term, leaving the term as it is.
+
+        Args:
+            peers (list): The ports of the other members.
+
+        Returns:
+            bool: Whether a majority would, with no leader or newer term heard from meanwhile.
+        """
+        with self.log_lock:
+            if not self.running:
+                return False
+            # Try again after another election timeout if the pre-vote is lost
+            self.reset_election_timer()
+            leader_contact = self.leader_contact
+            last_log_index = self.log.last_offset
+            vote_request = {
+                "term": self.current_term + 1,
+                "candidate_id": self.port,
+                "last_log_index": last_log_index,
+                "last_log_term": self.term_at(last_log_index),
+                "pre_vote": True,
+            }
+        votes = 1 + self.request_votes(peers, vote_request)
+        with self.log_lock:
+            if not self.running or self.current_term + 1 != vote_request["term"] or self.leader_contact != leader_contact:
+                return False
+            if 2 * votes <= len(peers) + 1:
+                print(f"Lost the pre-vote for term {vote_request['term']} with {votes} of {len(peers) + 1} votes")
+                return False
+            return True
+
+    def request_votes(self, peers, vote_request):
+        """
+        Send RequestVote or a pre-vote to every peer in parallel and return once the outcome is decided.
+
+        Args:
+            peers (list): The ports of the other members.
+            vote_request (dict): The RequestVote arguments.
+
+        Returns:
+            int: The votes granted by the time a majority voted, every peer answered or
+                the minimum election timeout passed.
+        """
+        needed = (len(peers) + 1) // 2
+        if needed == 0:
+            return 0
+        tally = {"granted": 0, "answered": 0}
+        tally_lock = threading.Lock()
+        decided = threading.Event()
+
+        def ask(peer):
+            try:
+                response = self.peers.get(peer).post("/request_vote", json=vote_request, timeout=self.election_timeout_min).json()
+            except RPCError:
+                response = {"term": 0, "vote_granted": False}
+            if response["term"] > vote_request["term"]:
+                self.adopt_term(response["term"])
+            with tally_lock:
+                tally["answered"] += 1
+                tally["granted"] += 1 if response["vote_granted"] else 0
+                if tally["granted"] >= needed or tally["answered"] == len(peers):
+                    decided.set()
+
+        for peer in peers:
+            threading.Thread(target=ask, args=(peer,), daemon=True).start()
+        decided.wait(self.election_timeout_min)
+        with tally_lock:
+            return tally["granted"]
 
 # FastAPI endpoints
+@app.on_event("startup")
+async def start_replication():
+    """
+    Remember the event loop, start measuring its lag, and start replicating if this node
+    leads or the election timer if it follows.
+    """
+    Node.loop = asyncio.get_running_loop()
+    loop_monitor.start()
+    if isinstance(node, Leader):
+        node.replicator.start()
+    else:
+        node.start_timers()
+
 @app.post("/register_follower")
-async def register_follower(follower_data: FollowerRegistration, background_tasks: BackgroundTasks):
+async def register_follower(follower_data: FollowerRegistration):
     """
     Endpoint to register a follower with the leader node.
 
     Args:
         follower_data (FollowerRegistration): Data for registering a follower.
-        background_tasks (BackgroundTasks): Background tasks to send a heartbeat to the new follower.
 
     Returns:
         dict: A message indicating the successful registration of the follower.
     """
     if isinstance(node, Leader):
-        node.config = node.read_config("config.json")
+        node.config = await node.run_io(node.read_config, "config.json")
         new_follower_port = follower_data.follower_port
 
         if new_follower_port not in node.config["follower_nodes"]:
             node.config["follower_nodes"].append(new_follower_port)
-            node.write_config("config.json", node.config)
+            await node.run_io(node.write_config, "config.json", node.config)
             node.update_eventlog("api_invocation", {"endpoint": "register_follower", "data": follower_data.dict()})
 
-            # Add the send_heartbeat task only if the node is a Leader
-            if isinstance(node, Leader):
-                background_tasks.add_task(node.send_heartbeat, new_follower_port)
+            # Start a replication loop for the new follower
+            node.replicator.add_follower(new_follower_port)
         return {"message": "Follower registered"}
     else:
         return {"message": "Not a leader node"}
@@ -358,44 +1663,146 @@ async def register_follower(follower_data: FollowerRegistration, background_task
 #     return {"message": "Acknowledged"}
 
 @app.post("/heartbeat")
-def heartbeat(heartbeat_payload: dict):
+def heartbeat(heartbeat_payload: AppendEntriesRequest):
     """
-    Endpoint to handle heartbeats from the leader, which includes metadata and event log.
+    Endpoint to handle AppendEntries requests from the leader.
+
+    An empty entries list is a plain heartbeat.
 
     Args:
-        heartbeat_payload (dict): Payload received in the heartbeat request, including metadata and event log.
+        heartbeat_payload (AppendEntriesRequest): The leader's AppendEntries request.
 
     Returns:
-        dict: A message indicating acknowledgment.
+        dict: The follower's term, whether the entries were accepted, and its match index.
     """
+    if isinstance(node, Leader) and heartbeat_payload.term > node.current_term:
+        node.adopt_term(heartbeat_payload.term, heartbeat_payload.leader_id)
     if isinstance(node, Follower):
-        with threading.Lock():
-            # Update last heartbeat time
-            node.last_heartbeat_time = datetime.now()
-
-            # Update metadata and event log
-            if "metadata" in heartbeat_payload:
-                node.create_or_update_file(f"{node.port}/metadata.json", heartbeat_payload["metadata"])
-            if "eventlog" in heartbeat_payload:
-                node.create_or_update_file(f"{node.port}/eventlog.json", heartbeat_payload["eventlog"])
-            
-            # Log the receipt of the heartbeat
-            node.update_eventlog("heartbeat_received", {"from_port": node.port})
-
-    return {"message": "Acknowledged"}
-
-@app.post("/set_leader/{port_number}")
-def set_leader(port_number: int):
-    global node
+        response = node.append_entries(heartbeat_payload.dict())
+
+        # Log the receipt of the heartbeat
+        node.update_eventlog("heartbeat_received", {"from_port": heartbeat_payload.leader_id})
+        return response
+    return {"term": node.current_term, "success": False, "conflict_index": node.log.last_offset + 1}
+
+@app.post("/install_snapshot")
+def install_snapshot(snapshot_payload: InstallSnapshotRequest):
+    """
+    Endpoint to receive a snapshot from the leader when this follower is behind the leader's log.
+
+    Args:
+        snapshot_payload (InstallSnapshotRequest): The snapshot and the index and term it covers.
+
+    Returns:
+        dict: The follower's term and the index it now matches.
+    """
+    if isinstance(node, Leader) and snapshot_payload.term > node.current_term:
+        node.adopt_term(snapshot_payload.term, snapshot_payload.leader_id)
     if isinstance(node, Follower):
-        node.update_eventlog("api_invocation", {"endpoint": "set_leader", "port_number": port_number})
-        print(f"Sending vote to {port_number} from {node.port}")
-        print(f"I am a follower now and my leader is {port_number}")
-        node = Follower(node.port, port_number)
-    return {"message": f"Vote from {node.port}"}
+        return node.install_snapshot(snapshot_payload.dict())
+    return {"term": node.current_term, "success": False, "match_index": 0}
 
+@app.get("/metrics")
+async def metrics():
+    """
+    Endpoint reporting event loop lag, to confirm no handler blocks the loop, the audit logger's
+    counters and the failure detector state of every peer.
+
+    Returns:
+        dict: Lag statistics over the recent samples, in milliseconds, audit event counts and,
+            by peer port, the learned heartbeat intervals, phi and whether the peer is suspected.
+    """
+    return {
+        "event_loop_lag": loop_monitor.stats(),
+        "audit": node.audit.stats(),
+        "failure_detectors": {port: detector.state() for port, detector in list(node.detectors.items())},
+    }
+
+@app.post("/read_index")
+async def read_index():
+    """
+    Endpoint for followers to get a read index for a linearizable read.
+
+    Returns:
+        dict: The commit index confirmed by a majority, or a message if this node
+            is not the leader or could not confirm its leadership.
+    """
+    if isinstance(node, Leader):
+        index = await node.get_read_index()
+        if index is None:
+            return {"message": "Could not confirm leadership"}
+        return {"read_index": index}
+    else:
+        return {"message": "Not a leader node"}
+
+@app.post("/request_vote")
+def request_vote(vote_request: VoteRequest):
+    """
+    Endpoint for candidates to ask for this node's vote.
+
+    Args:
+        vote_request (VoteRequest): The candidate's term and the index and term of its last log entry.
+
+    Returns:
+        dict: This node's term and whether it granted the vote.
+    """
+    if isinstance(node, Leader) and vote_request.term > node.current_term and not vote_request.pre_vote:
+        node.adopt_term(vote_request.term)
+    response = node.request_vote(vote_request.dict())
+    node.update_eventlog("api_invocation", {"endpoint": "request_vote", "candidate_id": vote_request.candidate_id, "pre_vote": vote_request.pre_vote, "vote_granted": response["vote_granted"]})
+    return response
+
+@app.post("/timeout_now")
+def timeout_now(request: TimeoutNowRequest):
+    """
+    Endpoint for the leader to hand leadership to this node.
+
+    Args:
+        request (TimeoutNowRequest): The leader's term and port.
+
+    Returns:
+        dict: This node's term and whether it started an election.
+    """
+    node.update_eventlog("api_invocation", {"endpoint": "timeout_now", "leader_id": request.leader_id})
+    if isinstance(node, Leader):
+        return {"term": node.current_term, "success": False}
+    return node.timeout_now(request.dict())
+
+## Hand leadership to a follower, e.g. before restarting the leader
+@app.post("/transfer_leadership")
+async def transfer_leadership(request: TransferLeadershipRequest):
+    """
+    Endpoint to move leadership to a follower with a write pause of about one RPC round.
+
+    Args:
+        request (TransferLeadershipRequest): The follower to hand over to, or none for the most up to date one.
+
+    Returns:
+        dict: Whether leadership was handed over and the new leader's port, or a message if
+            this node is not the leader.
+    """
+    if isinstance(node, Leader):
+        node.update_eventlog("api_invocation", {"endpoint": "transfer_leadership", "follower_port": request.follower_port})
+        return await node.transfer_leadership(request.follower_port)
+    else:
+        return {"message": "Not a leader node"}
 
+@app.get("/status")
+def status():
+    """
+    Endpoint reporting this node's Raft role and progress.
 
+    Returns:
+        dict: The role, current term, known leader, commit index and applied index.
+    """
+    return {
+        "port": node.port,
+        "role": "leader" if isinstance(node, Leader) else "follower",
+        "term": node.current_term,
+        "leader": node.port if isinstance(node, Leader) else node.leader_port,
+        "commit_index": node.commit_index,
+        "applied_index": node.store.applied_index,
+    }
 
 @app.post("/register_broker/")
 async def register_broker(broker: BrokerRecord):
@@ -410,63 +1817,117 @@ async def register_broker(broker: BrokerRecord):
     """
     if isinstance(node, Leader):
         node.update_eventlog("api_invocation", {"endpoint": "register_broker", "broker": broker.dict()})
-        filePath = f"{node.port}/metadata.json"
-        data = load_data(filePath)
-        foundDict = checkBrokerExists(broker.dict(),data["RegisterBrokerRecords"]["records"])
+        foundDict = node.store.get_broker(broker.brokerId)
         if(foundDict):
             return foundDict['internal_uuid']
-        timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        data["RegisterBrokerRecords"]['timestamp'] = timestamp
         serverSetup = broker.dict()
         serverSetup["internal_uuid"] = str(uuid.uuid4())
         serverSetup["brokerStatus"] = "ALIVE"
         serverSetup["epoch"] = 0
-        data["RegisterBrokerRecords"]["records"].append(serverSetup)
-        save_data(filePath,data)
-        return serverSetup["internal_uuid"]
+        return await node.commit(REGISTER_BROKER, serverSetup)
     else:
         return {"message": "Not a leader node"}
 
 
-## Get all brokers
-@app.get("/get_broker/")
-async def get_allbrokers():
+## Register brokers in one batch
+@app.post("/register_brokers/")
+async def register_brokers(brokers: List[BrokerRecord]):
     """
-    Retrieves a list of all registered brokers.
+    Registers many brokers with a single log entry.
+
+    The batch is validated as a whole and either every new broker is registered or none is.
+
+    Args:
+        brokers (List[BrokerRecord]): The brokers to register.
 
     Returns:
-        list: A list of registered broker records.
+        dict: Per broker, in request order, its internal UUID, or with a message and nothing
+            registered, the reason each rejected broker was refused.
     """
     if isinstance(node, Leader):
-        node.update_eventlog("api_invocation", {"endpoint": "get_allbrokers"})
-        filePath = f"{node.port}/metadata.json"
-        data = load_data(filePath)
-        return data["RegisterBrokerRecords"]["records"]
+        node.update_eventlog("api_invocation", {"endpoint": "register_brokers", "count": len(brokers)})
+        if len(brokers) > node.max_batch_records:
+            return {"message": f"Batch of {len(brokers)} exceeds the limit of {node.max_batch_records} records"}
+        results, records, rejected = [], [], False
+        seen = set()
+        for broker in brokers:
+            if broker.brokerId in seen:
+                results.append({"message": f"Duplicate brokerId {broker.brokerId}"})
+                rejected = True
+                continue
+            seen.add(broker.brokerId)
+            foundDict = node.store.get_broker(broker.brokerId)
+            if foundDict:
+                results.append(foundDict["internal_uuid"])
+                continue
+            serverSetup = broker.dict()
+            serverSetup["internal_uuid"] = str(uuid.uuid4())
+            serverSetup["brokerStatus"] = "ALIVE"
+            serverSetup["epoch"] = 0
+            records.append((len(results), REGISTER_BROKER, serverSetup))
+            results.append(None)
+        if rejected:
+            return {"message": "Batch rejected, nothing was registered", "results": results}
+        return await node.commit_batch(results, records)
     else:
         return {"message": "Not a leader node"}
 
+## Get all brokers
+@app.get("/get_broker/")
+async def get_allbrokers(
+    stale: bool = False,
+    if_none_match: Optional[str] = Header(None),
+    cursor: Optional[str] = None,
+    limit: Optional[int] = Query(None, ge=1),
+    fields: Optional[str] = None,
+    brokerStatus: Optional[str] = None,
+    rackId: Optional[str] = None,
+):
+    """
+    Retrieves a list of all registered brokers.
+
+    Args:
+        stale (bool): Serve from this node's state without confirming the read index.
+        if_none_match (str, optional): The ETag of the caller's copy.
+        cursor (str, optional): The next_cursor of the previous page.
+        limit (int, optional): Records per page.
+        fields (str, optional): Comma-separated fields to return for each record.
+        brokerStatus (str, optional): Only brokers with this status.
+        rackId (str, optional): Only brokers in this rack.
+
+    Returns:
+        Response: A list of registered broker records, or 304 if the caller's copy is current.
+            If any paging, filtering or projection parameter is given, a dict with one page
+            of "records" in key order and the "next_cursor" instead.
+    """
+    node.update_eventlog("api_invocation", {"endpoint": "get_allbrokers"})
+    if not await node.read_barrier(stale):
+        return {"message": "Could not confirm the read index with the leader"}
+    filters = {"brokerStatus": brokerStatus, "rackId": rackId}
+    if cursor is None and limit is None and fields is None and all(value is None for value in filters.values()):
+        return node.cached_response("get_allbrokers", ["RegisterBrokerRecords"], node.store.list_brokers, if_none_match)
+    return node.list_page("brokers", cursor, limit, fields, **filters)
+
 ## Get broker by id
 @app.get("/get_broker/{broker_id}")
-async def get_broker_by_ID(broker_id:int):
+async def get_broker_by_ID(broker_id:int, stale: bool = False):
     """
     Retrieves a specific broker by its ID.
 
     Args:
         broker_id (int): The ID of the broker to retrieve.
+        stale (bool): Serve from this node's state without confirming the read index.
 
     Returns:
         dict: The broker record if found, otherwise a 'Broker Not Found' message.
     """
-    if isinstance(node, Leader):
-        node.update_eventlog("api_invocation", {"endpoint": "get_broker_by_ID", "broker_id": broker_id})
-        filePath = f"{node.port}/metadata.json"
-        data = load_data(filePath)
-        found_dict = next((broker for broker in data["RegisterBrokerRecords"]["records"] if broker.get("brokerId") == broker_id), None)
-        if found_dict:
-            return found_dict
-        return "Broker Not Found"
-    else:
-        return {"message": "Not a leader node"}
+    node.update_eventlog("api_invocation", {"endpoint": "get_broker_by_ID", "broker_id": broker_id})
+    if not await node.read_barrier(stale):
+        return {"message": "Could not confirm the read index with the leader"}
+    found_dict = node.store.get_broker(broker_id)
+    if found_dict:
+        return found_dict
+    return "Broker Not Found"
 
 ## Delete broker by id
 @app.delete("/delete_broker/{broker_id}")
@@ -482,17 +1943,9 @@ async def delete_broker(broker_id: int):
     """
     if isinstance(node, Leader):
         node.update_eventlog("api_invocation", {"endpoint": "delete_broker", "broker_id": broker_id})
-        filePath = f"{node.port}/metadata.json"
-        data = load_data(filePath)
-        brokers = data["RegisterBrokerRecords"]["records"]
-        index = next((index for index, broker in enumerate(brokers) if broker.get("brokerId") == broker_id), None)
         deletedBroker = None
-        if index is not None:
-            deletedBroker = brokers.pop(index)
-        data["RegisterBrokerRecords"]["records"] = brokers
-        timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        data["RegisterBrokerRecords"]["timestamp"] = timestamp
-        save_data(filePath,data)
+        if node.store.get_broker(broker_id) is not None:
+            deletedBroker = await node.commit(UNREGISTER_BROKER, {"brokerId": broker_id})
         return deletedBroker if deletedBroker is not None else "Broker Not Found"
     else:
         return {"message": "Not a leader node"}
@@ -510,59 +1963,105 @@ async def register_topic(topicRecord:TopicRecord):
     """
     if isinstance(node, Leader):
         node.update_eventlog("api_invocation", {"endpoint": "register_topic", "topic_record": topicRecord.dict()})
-        filePath = f"{node.port}/metadata.json"
-        data = load_data(filePath)
-        found_dict = next((topic for topic in data["TopicRecord"]["records"] if topic.get("name") == topicRecord.name), None)
+        found_dict = node.store.get_topic(topicRecord.name)
         if(found_dict):
             return found_dict['topicUUID']
         serverSetup = {"name":topicRecord.name,"topicUUID":str(uuid.uuid4())}
-        data["TopicRecord"]["records"].append(serverSetup)
-        timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        data["TopicRecord"]["timestamp"] = timestamp
-        save_data(filePath,data)
-        return serverSetup["topicUUID"]
+        return await node.commit(TOPIC, serverSetup)
+    else:
+        return {"message": "Not a leader node"}
+
+## Register topics in one batch
+@app.post("/register_topics/")
+async def register_topics(topicRecords: List[TopicRecord]):
+    """
+    Registers many topics with a single log entry.
+
+    The batch is validated as a whole and either every new topic is registered or none is.
+
+    Args:
+        topicRecords (List[TopicRecord]): The topics to register.
+
+    Returns:
+        dict: Per topic, in request order, its UUID, or with a message and nothing
+            registered, the reason each rejected topic was refused.
+    """
+    if isinstance(node, Leader):
+        node.update_eventlog("api_invocation", {"endpoint": "register_topics", "count": len(topicRecords)})
+        if len(topicRecords) > node.max_batch_records:
+            return {"message": f"Batch of {len(topicRecords)} exceeds the limit of {node.max_batch_records} records"}
+        results, records, rejected = [], [], False
+        seen = set()
+        for topicRecord in topicRecords:
+            if topicRecord.name in seen:
+                results.append({"message": f"Duplicate topic name {topicRecord.name}"})
+                rejected = True
+                continue
+            seen.add(topicRecord.name)
+            found_dict = node.store.get_topic(topicRecord.name)
+            if found_dict:
+                results.append(found_dict["topicUUID"])
+                continue
+            records.append((len(results), TOPIC, {"name": topicRecord.name, "topicUUID": str(uuid.uuid4())}))
+            results.append(None)
+        if rejected:
+            return {"message": "Batch rejected, nothing was registered", "results": results}
+        return await node.commit_batch(results, records)
     else:
         return {"message": "Not a leader node"}
 
 ## Get Topic by topic name
 @app.get("/get_topic/{topicName}")
-async def getTopicByName(topicName:str):
+async def getTopicByName(topicName:str, stale: bool = False):
     """
     Retrieves a specific topic by its name.
 
     Args:
         topicName (str): The name of the topic to retrieve.
+        stale (bool): Serve from this node's state without confirming the read index.
 
     Returns:
         dict: The topic record if found, otherwise a 'Topic Not Found' message.
     """
-    if isinstance(node, Leader):
-        node.update_eventlog("api_invocation", {"endpoint": "getTopicByName", "topic_name": topicName})
-        filePath = f"{node.port}/metadata.json"
-        data = load_data(filePath)
-        found_dict = next((topic for topic in data["TopicRecord"]["records"] if topic.get("name") == topicName), None)
-        if(found_dict):
-            return found_dict
-        return "Topic Not Found"
-    else:
-        return {"message": "Not a leader node"}
+    node.update_eventlog("api_invocation", {"endpoint": "getTopicByName", "topic_name": topicName})
+    if not await node.read_barrier(stale):
+        return {"message": "Could not confirm the read index with the leader"}
+    found_dict = node.store.get_topic(topicName)
+    if(found_dict):
+        return found_dict
+    return "Topic Not Found"
 
 ## Get all topics 
 @app.get("/get_topic/")
-async def getAllTopics():
+async def getAllTopics(
+    stale: bool = False,
+    if_none_match: Optional[str] = Header(None),
+    cursor: Optional[str] = None,
+    limit: Optional[int] = Query(None, ge=1),
+    fields: Optional[str] = None,
+):
     """
     Retrieves a list of all registered topics.
 
+    Args:
+        stale (bool): Serve from this node's state without confirming the read index.
+        if_none_match (str, optional): The ETag of the caller's copy.
+        cursor (str, optional): The next_cursor of the previous page.
+        limit (int, optional): Records per page.
+        fields (str, optional): Comma-separated fields to return for each record.
+
     Returns:
-        list: A list of registered topic records.
+        Response: A list of registered topic records, or 304 if the caller's copy is current.
+            If any paging, filtering or projection parameter is given, a dict with one page
+            of "records" in key order and the "next_cursor" instead.
     """
-    if isinstance(node, Leader):
-        node.update_eventlog("api_invocation", {"endpoint": "getAllTopics"})
-        filePath = f"{node.port}/metadata.json"
-        data = load_data(filePath)
-        return data["TopicRecord"]["records"]
-    else:
-        return {"message": "Not a leader node"}
+    node.update_eventlog("api_invocation", {"endpoint": "getAllTopics"})
+    if not await node.read_barrier(stale):
+        return {"message": "Could not confirm the read index with the leader"}
+    filters = {}
+    if cursor is None and limit is None and fields is None and all(value is None for value in filters.values()):
+        return node.cached_response("getAllTopics", ["TopicRecord"], node.store.list_topics, if_none_match)
+    return node.list_page("topics", cursor, limit, fields, **filters)
 
 ## Delete topic by topic name
 @app.delete("/delete_topic/{topicName}")
@@ -578,17 +2077,9 @@ async def delete_topicByName(topicName: str):
     """
     if isinstance(node, Leader):
         node.update_eventlog("api_invocation", {"endpoint": "delete_topicByName", "topic_name": topicName})
-        filePath = f"{node.port}/metadata.json"
-        data = load_data(filePath)
-        topics = data["TopicRecord"]["records"]
-        index = next((index for index, topic in enumerate(topics) if topic.get("name") == topicName), None)
         deletedTopic = None
-        if index is not None:
-            deletedTopic = topics.pop(index)
-        data["TopicRecord"]["records"] = topics
-        timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        data["TopicRecord"]["timestamp"] = timestamp
-        save_data(filePath,data)
+        if node.store.get_topic(topicName) is not None:
+            deletedTopic = await node.commit(REMOVE_TOPIC, {"name": topicName})
         return deletedTopic if deletedTopic is not None else "Topic Not Found"
     else:
         return {"message": "Not a leader node"}
@@ -607,59 +2098,114 @@ async def register_partition(partitionRecord:PartitionRecord):
     """
     if isinstance(node, Leader):
         node.update_eventlog("api_invocation", {"endpoint": "register_partition", "partition_record": partitionRecord.dict()})
-        filePath = f"{node.port}/metadata.json"
-        data = load_data(filePath)
-        found_dict = next((partition for partition in data["PartitionRecord"]["records"] if partition.get("partitionId") == partitionRecord.partitionId), None)
+        found_dict = node.store.get_partition(partitionRecord.partitionId)
         if(found_dict):
             return found_dict['partitionId']
-        serverSetup = partitionRecord.dict()
-        data["PartitionRecord"]["records"].append(serverSetup)
-        timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        data["PartitionRecord"]["timestamp"] = timestamp
-        save_data(filePath,data)
-        return serverSetup["topicUUID"]
+        return await node.commit(PARTITION, partitionRecord.dict())
+    else:
+        return {"message": "Not a leader node"}
+
+## Register partitions in one batch
+@app.post("/register_partitions/")
+async def register_partitions(partitionRecords: List[PartitionRecord]):
+    """
+    Registers many partitions, e.g. all partitions of a new topic, with a single log entry.
+
+    The batch is validated as a whole and either every new partition is registered or none is.
+    Every partition must belong to a registered topic.
+
+    Args:
+        partitionRecords (List[PartitionRecord]): The partitions to register.
+
+    Returns:
+        dict: Per partition, in request order, its topic UUID (or its ID if it already
+            existed), or with a message and nothing registered, the reason each rejected
+            partition was refused.
+    """
+    if isinstance(node, Leader):
+        node.update_eventlog("api_invocation", {"endpoint": "register_partitions", "count": len(partitionRecords)})
+        if len(partitionRecords) > node.max_batch_records:
+            return {"message": f"Batch of {len(partitionRecords)} exceeds the limit of {node.max_batch_records} records"}
+        results, records, rejected = [], [], False
+        seen = set()
+        for partitionRecord in partitionRecords:
+            if partitionRecord.partitionId in seen:
+                results.append({"message": f"Duplicate partitionId {partitionRecord.partitionId}"})
+                rejected = True
+                continue
+            seen.add(partitionRecord.partitionId)
+            found_dict = node.store.get_partition(partitionRecord.partitionId)
+            if found_dict:
+                results.append(found_dict["partitionId"])
+                continue
+            if node.store.get_topic_by_uuid(partitionRecord.topicUUID) is None:
+                results.append({"message": f"Unknown topicUUID {partitionRecord.topicUUID}"})
+                rejected = True
+                continue
+            records.append((len(results), PARTITION, partitionRecord.dict()))
+            results.append(None)
+        if rejected:
+            return {"message": "Batch rejected, nothing was registered", "results": results}
+        return await node.commit_batch(results, records)
     else:
         return {"message": "Not a leader node"}
 
 ## Get partition by prtitionId
 @app.get("/get_partition/{partitionId}")
-async def get_partitionByID(partitionId:int):
+async def get_partitionByID(partitionId:int, stale: bool = False):
     """
     Retrieves a specific partition by its ID.
 
     Args:
         partitionId (int): The ID of the partition to retrieve.
+        stale (bool): Serve from this node's state without confirming the read index.
 
     Returns:
         dict: The partition record if found, otherwise a 'Partition Not Found' message.
     """
-    if isinstance(node, Leader):
-        node.update_eventlog("api_invocation", {"endpoint": "get_partitionByID", "partition_id": partitionId})
-        filePath = f"{node.port}/metadata.json"
-        data = load_data(filePath)
-        found_dict = next((partition for partition in data["PartitionRecord"]["records"] if partition.get("partitionId") == partitionId), None)
-        if(found_dict):
-            return found_dict
-        return "Partition Not Found"
-    else:
-        return {"message": "Not a leader node"}
+    node.update_eventlog("api_invocation", {"endpoint": "get_partitionByID", "partition_id": partitionId})
+    if not await node.read_barrier(stale):
+        return {"message": "Could not confirm the read index with the leader"}
+    found_dict = node.store.get_partition(partitionId)
+    if(found_dict):
+        return found_dict
+    return "Partition Not Found"
 
 ## Get all partitions
 @app.get("/get_partition/")
-async def get_allpartitions():
+async def get_allpartitions(
+    stale: bool = False,
+    if_none_match: Optional[str] = Header(None),
+    cursor: Optional[str] = None,
+    limit: Optional[int] = Query(None, ge=1),
+    fields: Optional[str] = None,
+    topicUUID: Optional[str] = None,
+    leader: Optional[str] = None,
+):
     """
     Retrieves a list of all registered partitions.
 
+    Args:
+        stale (bool): Serve from this node's state without confirming the read index.
+        if_none_match (str, optional): The ETag of the caller's copy.
+        cursor (str, optional): The next_cursor of the previous page.
+        limit (int, optional): Records per page.
+        fields (str, optional): Comma-separated fields to return for each record.
+        topicUUID (str, optional): Only partitions of this topic.
+        leader (str, optional): Only partitions led by this replica.
+
     Returns:
-        list: A list of registered partition records.
+        Response: A list of registered partition records, or 304 if the caller's copy is current.
+            If any paging, filtering or projection parameter is given, a dict with one page
+            of "records" in key order and the "next_cursor" instead.
     """
-    if isinstance(node, Leader):
-        node.update_eventlog("api_invocation", {"endpoint": "get_allpartitions"})
-        filePath = f"{node.port}/metadata.json"
-        data = load_data(filePath)
-        return data["PartitionRecord"]["records"]
-    else:
-        return {"message": "Not a leader node"}
+    node.update_eventlog("api_invocation", {"endpoint": "get_allpartitions"})
+    if not await node.read_barrier(stale):
+        return {"message": "Could not confirm the read index with the leader"}
+    filters = {"topicUUID": topicUUID, "leader": leader}
+    if cursor is None and limit is None and fields is None and all(value is None for value in filters.values()):
+        return node.cached_response("get_allpartitions", ["PartitionRecord"], node.store.list_partitions, if_none_match)
+    return node.list_page("partitions", cursor, limit, fields, **filters)
 
 ## Delete a partition by partitionId
 @app.delete("/delete_partition/{partition_id}")
@@ -675,17 +2221,11 @@ async def delete_partition(partition_id: int):
     """
     if isinstance(node, Leader):
         node.update_eventlog("api_invocation", {"endpoint": "delete_partition", "partition_id": partition_id})
-        filePath = f"{node.port}/metadata.json"
-        data = load_data(filePath)
-        partitions = data["PartitionRecord"]["records"]
-        index = next((index for index, partition in enumerate(partitions) if partition.get("partitionId") == partition_id), None)
         deletedPartition = None
-        if index is not None:
-            deletedPartition = partitions.pop(index)
-        data["PartitionRecord"]["records"] = partitions
-        timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        data["PartitionRecord"]["timestamp"] = timestamp
-        save_data(filePath,data)
+        partition = node.store.get_partition(partition_id)
+        if partition is not None:
+            # The topic lets partition watches filter removals as well
+            deletedPartition = await node.commit(REMOVE_PARTITION, {"partitionId": partition_id, "topicUUID": partition["topicUUID"]})
         return deletedPartition if deletedPartition is not None else "Partition Not Found"
     else:
         return {"message": "Not a leader node"}
@@ -701,44 +2241,41 @@ async def register_broker_change(brokerChange:BrokerChangeRecord):
         brokerChange (BrokerChangeRecord): The broker change information.
 
     Returns:
-        str: A message indicating successful update or broker not found.
+        str: A message indicating successful update or broker not found, or a message
+            dict if the change was not committed.
     """
     if isinstance(node, Leader):
         node.update_eventlog("api_invocation", {"endpoint": "register_broker_change", "broker_change": brokerChange.dict()})
         brokerChange = brokerChange.dict()
-        filePath = f"{node.port}/metadata.json"
-        data = load_data(filePath)
-        brokers = data["RegisterBrokerRecords"]["records"]
-
-        for index,broker in enumerate(brokers):
-            if(broker["brokerId"]==brokerChange["brokerId"]):
-                brokers[index] = {**broker,**brokerChange}
-                brokers[index]["epoch"] += 1
-                timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-                data["RegisterBrokerRecords"]["timestamp"] = timestamp
-                data["RegistrationChangeBrokerRecord"]["timestamp"] = timestamp
-            
-                data["RegisterBrokerRecords"]["records"] = brokers
-                data["RegistrationChangeBrokerRecord"]["records"].append(brokerChange)
-                save_data(filePath,data)
+        if node.store.get_broker(brokerChange["brokerId"]) is not None:
+            updated = await node.commit(BROKER_CHANGE, brokerChange)
+            # Not committed: not the leader any more, a transfer in progress or no majority in time
+            if isinstance(updated, dict) and "message" in updated:
+                return updated
+            if updated is not None:
                 return "Changes Updated Successfully"
         return "Broker Not Found"
     else:
         return {"message": "Not a leader node"}
 
-## Fetch Changes from last timestamp
+## Fetch Changes from last offset
 @app.post("/metadata_fetch/")
-async def metadata_fetch():
+async def metadata_fetch(fetchRequest: MetadataFetchRequest):
     """
-    Fetches metadata changes since the last timestamp. 
-    (Note: Implementation logic is to be defined)
-    
+    Fetches the metadata changes committed after the offset the caller last applied.
+
+    Served by any node from the changes it has applied. Callers pass the returned
+    offset back on their next fetch. A caller behind the start of the log gets the
+    whole metadata as a snapshot instead and continues from its offset.
+
+    Args:
+        fetchRequest (MetadataFetchRequest): The last applied offset and the maximum number of entries to return.
+
     Returns:
-        TBD: Based on the implementation details.
+        dict: The new offset, and either the log entries after the old one or a snapshot.
     """
-    # Logic for metadata fetch
-    node.update_eventlog("api_invocation", {"endpoint": "metadata_fetch"})
-    pass
+    node.update_eventlog("api_invocation", {"endpoint": "metadata_fetch", "offset": fetchRequest.offset})
+    return await node.run_io(node.fetch_changes, fetchRequest.offset, fetchRequest.max_records)
 
 # Client Management API Endpoints
 
@@ -752,83 +2289,199 @@ async def register_producer(producerRecord: ProducerIdsRecord):
         producerRecord (ProducerIdsRecord): The producer information for registration.
 
     Returns:
-        str: A message indicating successful registration or if the broker is not recognized.
+        str: A message indicating successful registration or if the broker is not recognized,
+            or a message dict if the registration was not committed.
     """
     if isinstance(node, Leader):
         node.update_eventlog("api_invocation", {"endpoint": "register_producer", "producer_record": producerRecord.dict()})
-        filePath = f"{node.port}/metadata.json"
-        data = load_data(filePath)
-        foundDict = checkProducerExists(producerRecord.dict(),data["ProducerIdsRecord"]["records"])
+        foundDict = node.store.get_producer(producerRecord.brokerId, producerRecord.producerId)
         if(foundDict):
             return foundDict['producerId']
         serverSetup = producerRecord.dict()
-        found_dict = next((producer for producer in data["RegisterBrokerRecords"]["records"] if producer.get("internal_uuid") == serverSetup['brokerId']), None)
+        found_dict = node.store.get_broker_by_uuid(serverSetup['brokerId'])
         if found_dict:
             serverSetup["brokerEpoch"] = found_dict["epoch"]
-            data["ProducerIdsRecord"]["records"].append(serverSetup)
-            timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            data["ProducerIdsRecord"]['timestamp'] = timestamp
-            save_data(filePath,data)
+            registered = await node.commit(PRODUCER_IDS, serverSetup)
+            if isinstance(registered, dict) and "message" in registered:
+                return registered
             return "Producer Registered Successfully"
         return "Broker Not Recognised"
     else:
         return {"message": "Not a leader node"}
 
+## Allocate a block of producer IDs to a broker
+@app.post("/allocate_producer_ids/")
+async def allocate_producer_ids(blockRequest: ProducerIdBlockRequest):
+    """
+    Allocates the next block of PRODUCER_ID_BLOCK_SIZE producer IDs to a broker.
+
+    The broker then assigns IDs from the block to its producers locally, so the
+    metadata log grows by one record per block instead of one per producer.
+
+    Args:
+        blockRequest (ProducerIdBlockRequest): The broker's internal UUID and current epoch.
+
+    Returns:
+        dict: The block with its firstProducerId and lastProducerId, or a message if the
+            broker is not recognised or sent a stale epoch.
+    """
+    if isinstance(node, Leader):
+        node.update_eventlog("api_invocation", {"endpoint": "allocate_producer_ids", "block_request": blockRequest.dict()})
+        broker = node.store.get_broker_by_uuid(blockRequest.brokerId)
+        if broker is None:
+            return "Broker Not Recognised"
+        if blockRequest.brokerEpoch != broker["epoch"]:
+            return {"message": f"Stale broker epoch {blockRequest.brokerEpoch}, current epoch is {broker['epoch']}"}
+        return await node.commit(PRODUCER_ID_BLOCK, blockRequest.dict())
+    else:
+        return {"message": "Not a leader node"}
+
+## Get the block a producer ID was allocated in
+@app.get("/get_producer_id_block/{producer_id}")
+async def get_producer_id_block(producer_id: int, stale: bool = False):
+    """
+    Finds which broker a producer ID was allocated to.
+
+    Args:
+        producer_id (int): The producer ID.
+        stale (bool): Serve from this node's state without confirming the read index.
+
+    Returns:
+        dict: The block holding the ID if it was allocated, otherwise a 'Producer ID Not Allocated' message.
+    """
+    node.update_eventlog("api_invocation", {"endpoint": "get_producer_id_block", "producer_id": producer_id})
+    if not await node.read_barrier(stale):
+        return {"message": "Could not confirm the read index with the leader"}
+    block = node.store.get_producer_id_block(producer_id)
+    if block:
+        return block
+    return "Producer ID Not Allocated"
+
 ## Get producer by searchParams -> {partitionId:int, brokerId: str"uuid"}
 @app.post("/get_producer/")
-async def get_producer(searchParam:SearchParam):
+async def get_producer(searchParam:SearchParam, stale: bool = False):
     """
     Retrieves a specific producer based on search parameters.
 
     Args:
         searchParam (SearchParam): Parameters to search for a specific producer.
+        stale (bool): Serve from this node's state without confirming the read index.
 
     Returns:
         dict: The producer record if found, otherwise a 'Producer Not Found' message.
     """
-    if isinstance(node, Leader):
-        node.update_eventlog("api_invocation", {"endpoint": "get_producer", "search_param": searchParam.dict()})
-        filePath = f"{node.port}/metadata.json"
-        data = load_data(filePath)
-        foundDict = checkProducerExists(searchParam.dict(),data["ProducerIdsRecord"]["records"])
-        if(foundDict):
-            return foundDict
-        return "Producer Not Found"
-    else:
-        return {"message": "Not a leader node"}
+    node.update_eventlog("api_invocation", {"endpoint": "get_producer", "search_param": searchParam.dict()})
+    if not await node.read_barrier(stale):
+        return {"message": "Could not confirm the read index with the leader"}
+    foundDict = node.store.get_producer(searchParam.brokerId, searchParam.producerId)
+    if(foundDict):
+        return foundDict
+    return "Producer Not Found"
 
 ## Get all producers
 @app.get("/get_producer/")
-async def get_producers():
+async def get_producers(
+    stale: bool = False,
+    if_none_match: Optional[str] = Header(None),
+    cursor: Optional[str] = None,
+    limit: Optional[int] = Query(None, ge=1),
+    fields: Optional[str] = None,
+    brokerId: Optional[str] = None,
+):
     """
     Retrieves a list of all registered producers.
 
+    Args:
+        stale (bool): Serve from this node's state without confirming the read index.
+        if_none_match (str, optional): The ETag of the caller's copy.
+        cursor (str, optional): The next_cursor of the previous page.
+        limit (int, optional): Records per page.
+        fields (str, optional): Comma-separated fields to return for each record.
+        brokerId (str, optional): Only producers of this broker.
+
     Returns:
-        list: A list of registered producer records.
+        Response: A list of registered producer records, or 304 if the caller's copy is current.
+            If any paging, filtering or projection parameter is given, a dict with one page
+            of "records" in key order and the "next_cursor" instead.
     """
-    if isinstance(node, Leader):
-        node.update_eventlog("api_invocation", {"endpoint": "get_producers"})
-        filePath = f"{node.port}/metadata.json"
-        data = load_data(filePath)
-        return data["ProducerIdsRecord"]["records"]
-    else:
-        return {"message": "Not a leader node"}
+    node.update_eventlog("api_invocation", {"endpoint": "get_producers"})
+    if not await node.read_barrier(stale):
+        return {"message": "Could not confirm the read index with the leader"}
+    filters = {"brokerId": brokerId}
+    if cursor is None and limit is None and fields is None and all(value is None for value in filters.values()):
+        return node.cached_response("get_producers", ["ProducerIdsRecord"], node.store.list_producers, if_none_match)
+    return node.list_page("producers", cursor, limit, fields, **filters)
 
 ## Fetch Broker, Topic and Partition Records
 @app.get("/metadata_fetch_client/")
-async def metadata_fetch_client():
-    if isinstance(node, Leader):
-        node.update_eventlog("api_invocation", {"endpoint": "metadata_fetch_client"})
-        filePath = f"{node.port}/metadata.json"
-        data = load_data(filePath)
-        returnData = {}
-        returnData["RegisterBrokerRecords"] = data["RegisterBrokerRecords"]
-        returnData["TopicRecord"] = data["TopicRecord"]
-        returnData["PartitionRecord"] = data["PartitionRecord"]
-        returnData["RegistrationChangeBrokerRecord"] = data["RegistrationChangeBrokerRecord"]
-        return returnData
-    else:
-        return {"message": "Not a leader node"}
+async def metadata_fetch_client(stale: bool = False, if_none_match: Optional[str] = Header(None)):
+    """
+    Retrieves the broker, topic, partition and broker change records for clients.
+
+    Args:
+        stale (bool): Serve from this node's state without confirming the read index.
+        if_none_match (str, optional): The ETag of the caller's copy.
+
+    Returns:
+        Response: The requested sections of the metadata, or 304 if the caller's copy is current.
+    """
+    node.update_eventlog("api_invocation", {"endpoint": "metadata_fetch_client"})
+    if not await node.read_barrier(stale):
+        return {"message": "Could not confirm the read index with the leader"}
+    sections = ["RegisterBrokerRecords", "TopicRecord", "PartitionRecord", "RegistrationChangeBrokerRecord"]
+    return node.cached_response(
+        "metadata_fetch_client", sections, lambda: {section: node.store.section(section) for section in sections}, if_none_match
+    )
+
+## Watch for metadata changes
+@app.post("/watch/")
+async def watch(watchRequest: WatchRequest):
+    """
+    Long-polls for metadata changes after the offset the caller last applied.
+
+    Returns as soon as a matching change is committed, or with no entries once the
+    timeout expires. Callers pass the returned offset back on their next watch.
+
+    Args:
+        watchRequest (WatchRequest): The last applied offset, the timeout and the kinds of records to watch.
+
+    Returns:
+        dict: The new offset and the matching log entries, a snapshot if the caller is behind
+            the start of the log, or a message naming an unknown kind.
+    """
+    node.update_eventlog("api_invocation", {"endpoint": "watch", "offset": watchRequest.offset, "kinds": watchRequest.kinds})
+    unknown = [kind for kind in watchRequest.kinds if kind not in WATCH_KINDS]
+    if unknown:
+        return {"message": f"Unknown kinds {unknown}, expected any of {list(WATCH_KINDS)}"}
+    return await node.watch(watchRequest.offset, watchRequest.timeout, watchRequest.kinds, watchRequest.topicUUID)
+
+## Stream committed metadata records
+@app.get("/stream/")
+async def stream(offset: int = 0, last_event_id: Optional[str] = Header(None)):
+    """
+    Streams every committed metadata record as server-sent events, in commit order.
+
+    A reconnecting client resumes after the last event it received, sent either as
+    the Last-Event-ID header or as offset.
+
+    Args:
+        offset (int): Log index of the last change the caller applied.
+        last_event_id (str, optional): The Last-Event-ID header, "index" or "index.position"
+            within a batch, which takes precedence over offset.
+
+    Returns:
+        StreamingResponse: A text/event-stream of the records, or a message if Last-Event-ID is malformed.
+    """
+    position = None
+    if last_event_id is not None:
+        index, _, batch_position = last_event_id.partition(".")
+        try:
+            offset = int(index)
+            position = int(batch_position) if batch_position else None
+        except ValueError:
+            return {"message": f"Invalid Last-Event-ID {last_event_id!r}"}
+    node.update_eventlog("api_invocation", {"endpoint": "stream", "offset": offset, "position": position})
+    return StreamingResponse(node.stream_changes(offset, position), media_type="text/event-stream")
 
 if __name__ == "__main__":
     port = int(sys.argv[1])
@@ -0,0 +1,106 @@
+import asyncio
+import time
+
+
+class ReplicationScheduler:
+    """
+    Drives AppendEntries to every follower from the uvicorn event loop.
+
+    Each follower gets its own send loop, so a slow or dead follower only
+    delays itself. A loop sends at most one request at a time, waits for the
+    heartbeat interval between rounds, and goes again straight away while its
+    follower is behind or when woken for new entries. A shared semaphore caps
+    the number of requests in flight across all followers.
+    """
+
+    def __init__(self, leader, interval, max_in_flight=64, maintenance_interval=1.0):
+        """
+        Args:
+            leader (Leader): The leader whose log is replicated.
+            interval (float): Seconds between heartbeats to a caught-up follower.
+            max_in_flight (int): Upper bound on concurrent AppendEntries requests.
+            maintenance_interval (float): Seconds between snapshot checks and fsyncs.
+        """
+        self.leader = leader
+        self.interval = interval
+        self.max_in_flight = max_in_flight
+        self.maintenance_interval = maintenance_interval
+        self.tasks = {}
+        self.wakeups = {}
+        self.semaphore = None
+        self.maintenance = None
+        self.running = False
+
+    def start(self):
+        """
+        Start one send loop per known follower. Must run on the event loop.
+        """
+        self.running = True
+        self.semaphore = asyncio.Semaphore(self.max_in_flight)
+        for follower_port in self.leader.config["follower_nodes"]:
+            self.add_follower(follower_port)
+        self.maintenance = asyncio.ensure_future(self.maintenance_loop())
+
+    def stop(self):
+        """
+        Cancel every send loop. Must run on the event loop.
+        """
+        self.running = False
+        for task in self.tasks.values():
+            task.cancel()
+        if self.maintenance is not None:
+            self.maintenance.cancel()
+        self.tasks.clear()
+        self.wakeups.clear()
+
+    def add_follower(self, follower_port):
+        """
+        Start replicating to a follower, or wake its loop if it already runs.
+
+        Args:
+            follower_port (int): The port of the follower node.
+        """
+        if not self.running:
+            return
+        if follower_port in self.tasks:
+            self.wakeups[follower_port].set()
+            return
+        self.wakeups[follower_port] = asyncio.Event()
+        self.tasks[follower_port] = asyncio.ensure_future(self.follower_loop(follower_port))
+
+    def wake_all(self):
+        """
+        Send to every follower now instead of waiting for the next heartbeat tick.
+        """
+        for wakeup in self.wakeups.values():
+            wakeup.set()
+
+    async def follower_loop(self, follower_port):
+        wakeup = self.wakeups[follower_port]
+        loop = asyncio.get_running_loop()
+        while self.running:
+            wakeup.clear()
+            started = loop.time()
+            try:
+                async with self.semaphore:
+                    behind = await self.leader.send_heartbeat(follower_port)
+            except Exception as error:
+                print(f"Replication to follower on port {follower_port} failed: {error!r}")
+                behind = False
+            if behind:
+                continue
+            try:
+                await asyncio.wait_for(wakeup.wait(), timeout=max(0.0, started + self.interval - loop.time()))
+            except asyncio.TimeoutError:
+                pass
+
+    async def maintenance_loop(self):
+        """
+        Snapshot and fsync off the event loop every maintenance_interval seconds.
+        """
+        loop = asyncio.get_running_loop()
+        while self.running:
+            started = time.monotonic()
+            await loop.run_in_executor(None, self.leader.maybe_snapshot)
+            await loop.run_in_executor(None, self.leader.sync_logs)
+            await asyncio.sleep(max(0.0, self.maintenance_interval - (time.monotonic() - started)))
@@ -0,0 +1,78 @@
+import threading
+
+import httpx
+
+# Errors raised by peer RPCs: connection failures, timeouts and protocol errors
+RPCError = httpx.HTTPError
+
+
+class PeerPool:
+    """
+    Pooled HTTP clients for inter-node RPCs, one per peer port, in blocking
+    and asyncio flavours.
+
+    Every client keeps its connections alive between calls and bounds both
+    the connect and the read phase of each request, so heartbeats, votes and
+    registration to a dead peer fail fast instead of hanging.
+    """
+
+    def __init__(self, connect_timeout=0.5, read_timeout=2.0, max_connections=8, keepalive_expiry=30.0):
+        """
+        Args:
+            connect_timeout (float): Seconds allowed to open a TCP connection.
+            read_timeout (float): Seconds allowed for each read (and write) on a connection.
+            max_connections (int): Upper bound on concurrent connections to one peer.
+            keepalive_expiry (float): Seconds an idle connection is kept open for reuse.
+        """
+        self.timeout = httpx.Timeout(read_timeout, connect=connect_timeout)
+        self.limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_connections,
+            keepalive_expiry=keepalive_expiry,
+        )
+        self.clients = {}
+        self.async_clients = {}
+        self.lock = threading.Lock()
+
+    def get(self, port):
+        """
+        Return the pooled client for a peer, creating it on first use.
+
+        Args:
+            port (int): The peer's port.
+
+        Returns:
+            httpx.Client: A client whose relative URLs resolve against the peer.
+        """
+        client = self.clients.get(port)
+        if client is None:
+            with self.lock:
+                client = self.clients.get(port)
+                if client is None:
+                    client = httpx.Client(base_url=f"http://localhost:{port}", timeout=self.timeout, limits=self.limits)
+                    self.clients[port] = client
+        return client
+
+    def get_async(self, port):
+        """
+        Return the pooled asyncio client for a peer, creating it on first use.
+
+        Must be called from the event loop the client will be used on.
+
+        Args:
+            port (int): The peer's port.
+
+        Returns:
+            httpx.AsyncClient: A client whose relative URLs resolve against the peer.
+        """
+        client = self.async_clients.get(port)
+        if client is None:
+            client = httpx.AsyncClient(base_url=f"http://localhost:{port}", timeout=self.timeout, limits=self.limits)
+            self.async_clients[port] = client
+        return client
+
+    def close(self):
+        with self.lock:
+            for client in self.clients.values():
+                client.close()
+            self.clients.clear()
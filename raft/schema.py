@@ -1,5 +1,5 @@
 from pydantic import BaseModel
-from typing import List
+from typing import List, Optional
 
 class LeaderInformation(BaseModel):
     new_leader_port: int
@@ -8,12 +8,54 @@ class FollowerRegistration(BaseModel):
     follower_port: int
     
 class VoteRequest(BaseModel):
-    candidate_port: int
-    # term: int
+    term: int
+    candidate_id: int
+    last_log_index: int
+    last_log_term: int
+    # A pre-vote asks whether the vote would be granted in term, without changing any state
+    pre_vote: bool = False
 
 class LeaderData(BaseModel):
     leader_port: int
 
+class AppendEntriesRequest(BaseModel):
+    term: int
+    leader_id: int
+    prev_log_index: int
+    prev_log_term: int
+    entries: List[dict]
+    leader_commit: int
+
+class TimeoutNowRequest(BaseModel):
+    term: int
+    leader_id: int
+
+class TransferLeadershipRequest(BaseModel):
+    # The follower to hand leadership to; the most up to date one if omitted
+    follower_port: Optional[int] = None
+
+class InstallSnapshotRequest(BaseModel):
+    term: int
+    leader_id: int
+    last_included_index: int
+    last_included_term: int
+    metadata: dict
+
+class MetadataFetchRequest(BaseModel):
+    # Log index of the last change the caller applied, 0 for none
+    offset: int = 0
+    max_records: int = 500
+
+class WatchRequest(BaseModel):
+    # Log index of the last change the caller applied, 0 for none
+    offset: int = 0
+    # Seconds to wait for a matching change before returning an empty delta
+    timeout: float = 30
+    # Kinds of records to watch, any of WATCH_KINDS; empty watches everything
+    kinds: List[str] = []
+    # Only partition changes of this topic
+    topicUUID: Optional[str] = None
+
 class BrokerRecord(BaseModel):
     brokerId: int
     brokerHost:str
@@ -55,6 +97,10 @@ class ProducerIdsRecord(BaseModel):
     brokerEpoch: int
     producerId: int
 
+class ProducerIdBlockRequest(BaseModel):
+    brokerId: str
+    brokerEpoch: int
+
 class SearchParam(BaseModel):
     brokerId: str
     producerId: int
\ No newline at end of file
@@ -0,0 +1,325 @@
+import bisect
+import json
+import os
+import struct
+import threading
+import time
+import zlib
+
+# Record framing: 4-byte big-endian payload length, 4-byte CRC32 of the payload, then the payload
+HEADER = struct.Struct(">II")
+
+FSYNC_ALWAYS = "always"
+FSYNC_INTERVAL = "interval"
+FSYNC_NEVER = "never"
+
+
+class SegmentLog:
+    """
+    Append-only, length-prefixed, CRC-checked log split into segment files.
+
+    Records are JSON documents numbered by consecutive offsets starting at 1.
+    Each segment file is named after the offset of its first record, so a
+    restart only has to scan the last segment to find the next offset and
+    cut off a torn write.
+    """
+
+    def __init__(self, directory, segment_bytes=16 * 1024 * 1024, fsync_policy=FSYNC_INTERVAL, fsync_interval=1.0):
+        """
+        Open (or create) a log directory.
+
+        Args:
+            directory (str): Directory holding the segment files.
+            segment_bytes (int): Size after which a new segment is started.
+            fsync_policy (str): "always" to fsync every append, "interval" to fsync at most
+                once per fsync_interval seconds, or "never" to leave it to the OS.
+            fsync_interval (float): Seconds between fsyncs under the "interval" policy.
+        """
+        if fsync_policy not in (FSYNC_ALWAYS, FSYNC_INTERVAL, FSYNC_NEVER):
+            raise ValueError(f"Unknown fsync policy: {fsync_policy}")
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.fsync_policy = fsync_policy
+        self.fsync_interval = fsync_interval
+        self.lock = threading.RLock()
+        # Serializes fsyncs, which run outside self.lock so readers never wait for the disk
+        self.sync_lock = threading.Lock()
+        self.last_fsync = time.monotonic()
+        self.unsynced = False
+        # Bytes appended since the log was opened, used by size-based snapshot triggers
+        self.bytes_appended = 0
+        os.makedirs(directory, exist_ok=True)
+
+        # Base offsets of every segment, oldest first, and byte positions of records per segment
+        self.bases = sorted(int(name[:-4]) for name in os.listdir(directory) if name.endswith(".log"))
+        self.positions = {}
+        if not self.bases:
+            self.bases = [1]
+        self.active_positions = self._recover_tail()
+        self.positions[self.bases[-1]] = self.active_positions
+        self.next_offset = self.bases[-1] + len(self.active_positions)
+        self.active = open(self._segment_path(self.bases[-1]), "ab")
+
+    def _segment_path(self, base):
+        return os.path.join(self.directory, f"{base:020d}.log")
+
+    def _scan(self, path):
+        """
+        Scan a segment file and return the byte position of every valid record.
+
+        Returns:
+            tuple: (positions, valid_bytes) where valid_bytes is where the last good record ends.
+        """
+        positions = []
+        valid_bytes = 0
+        try:
+            with open(path, "rb") as file:
+                buffer = file.read()
+        except FileNotFoundError:
+            return positions, valid_bytes
+        while valid_bytes + HEADER.size <= len(buffer):
+            length, crc = HEADER.unpack_from(buffer, valid_bytes)
+            end = valid_bytes + HEADER.size + length
+            if end > len(buffer) or zlib.crc32(buffer[valid_bytes + HEADER.size:end]) != crc:
+                break
+            positions.append(valid_bytes)
+            valid_bytes = end
+        return positions, valid_bytes
+
+    def _recover_tail(self):
+        """
+        Validate the last segment, truncating anything after the last intact record.
+
+        Returns:
+            list: Byte positions of the records in the last segment.
+        """
+        path = self._segment_path(self.bases[-1])
+        positions, valid_bytes = self._scan(path)
+        if os.path.exists(path) and os.path.getsize(path) != valid_bytes:
+            print(f"Truncating torn write in {path} at byte {valid_bytes}")
+            with open(path, "r+b") as file:
+                file.truncate(valid_bytes)
+        return positions
+
+    @property
+    def first_offset(self):
+        """int: Offset of the oldest record still on disk."""
+        return self.bases[0]
+
+    @property
+    def last_offset(self):
+        """int: Offset of the newest record, or first_offset - 1 when the log is empty."""
+        return self.next_offset - 1
+
+    def append(self, record):
+        """
+        Append one record to the log.
+
+        Args:
+            record (dict): A JSON-serialisable record.
+
+        Returns:
+            int: The offset assigned to the record.
+        """
+        return self.append_many([record])[0]
+
+    def append_many(self, records):
+        """
+        Append several records with a single flush and at most one fsync.
+
+        Args:
+            records (list): JSON-serialisable records, in order.
+
+        Returns:
+            list: The offsets assigned to the records.
+        """
+        if not records:
+            return []
+        frames = []
+        for record in records:
+            payload = json.dumps(record, separators=(",", ":")).encode()
+            frames.append(HEADER.pack(len(payload), zlib.crc32(payload)) + payload)
+        with self.lock:
+            offsets = []
+            for frame in frames:
+                if self.active_positions and self.active.tell() + len(frame) > self.segment_bytes:
+                    self.active.flush()
+                    self._roll()
+                self.active_positions.append(self.active.tell())
+                self.active.write(frame)
+                self.unsynced = True
+                self.bytes_appended += len(frame)
+                offsets.append(self.next_offset)
+                self.next_offset += 1
+            self.active.flush()
+        self._maybe_fsync()
+        return offsets
+
+    def _roll(self):
+        """
+        Seal the active segment and start a new one at the next offset.
+        """
+        if self.unsynced:
+            os.fsync(self.active.fileno())
+            self.unsynced = False
+        self.active.close()
+        self.bases.append(self.next_offset)
+        self.active_positions = []
+        self.positions[self.next_offset] = self.active_positions
+        self.active = open(self._segment_path(self.next_offset), "ab")
+
+    def _maybe_fsync(self):
+        if self.fsync_policy == FSYNC_ALWAYS:
+            self.sync()
+        elif self.fsync_policy == FSYNC_INTERVAL and time.monotonic() - self.last_fsync >= self.fsync_interval:
+            self.sync()
+
+    def sync(self):
+        """
+        Force buffered appends to stable storage.
+
+        Returns once every record appended before the call is on disk. Reads and
+        appends from other threads go ahead while the fsync runs.
+        """
+        with self.sync_lock:
+            with self.lock:
+                if not self.unsynced:
+                    self.last_fsync = time.monotonic()
+                    return
+                # The active segment may be rolled or truncated while this fsync runs
+                fd = os.dup(self.active.fileno())
+                self.unsynced = False
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+            self.last_fsync = time.monotonic()
+
+    def read(self, start_offset, max_records=None):
+        """
+        Read records starting at an offset.
+
+        Args:
+            start_offset (int): The first offset to return.
+            max_records (int, optional): Upper bound on the number of records returned.
+
+        Returns:
+            list: The records from start_offset onwards, oldest first.
+        """
+        records = []
+        with self.lock:
+            start_offset = max(start_offset, self.first_offset)
+            if start_offset >= self.next_offset:
+                return records
+            segment = bisect.bisect_right(self.bases, start_offset) - 1
+            for base in self.bases[segment:]:
+                positions = self._segment_positions(base)
+                skip = start_offset - base if base <= start_offset else 0
+                with open(self._segment_path(base), "rb") as file:
+                    if skip < len(positions):
+                        file.seek(positions[skip])
+                    for _ in positions[skip:]:
+                        length, _crc = HEADER.unpack(file.read(HEADER.size))
+                        records.append(json.loads(file.read(length)))
+                        if max_records is not None and len(records) >= max_records:
+                            return records
+        return records
+
+    def _segment_positions(self, base):
+        if base not in self.positions:
+            self.positions[base] = self._scan(self._segment_path(base))[0]
+        return self.positions[base]
+
+    def truncate_prefix(self, offset):
+        """
+        Delete every sealed segment whose records all sit at or below an offset.
+
+        The active segment is never deleted, so records below the offset may remain
+        readable until the segment that holds them is sealed.
+
+        Args:
+            offset (int): The highest offset that may be discarded.
+        """
+        with self.lock:
+            while len(self.bases) > 1 and self.bases[1] <= offset + 1:
+                base = self.bases.pop(0)
+                self.positions.pop(base, None)
+                os.remove(self._segment_path(base))
+
+    def truncate_suffix(self, offset):
+        """
+        Delete every record at or above an offset, so the next append gets that offset.
+
+        Args:
+            offset (int): The first offset to discard.
+        """
+        with self.lock:
+            if offset >= self.next_offset:
+                return
+            if offset <= self.first_offset:
+                self.reset(offset)
+                return
+            # Work out what to keep before touching anything, so a failed scan leaves the log as it was
+            dropped = self.bases[bisect.bisect_left(self.bases, offset):]
+            base = self.bases[-len(dropped) - 1]
+            positions = self._segment_positions(base)
+            # When the offset starts a segment, keep is the whole of the previous one
+            keep = offset - base
+            self.active.close()
+            for dropped_base in reversed(dropped):
+                self.bases.pop()
+                self.positions.pop(dropped_base, None)
+                os.remove(self._segment_path(dropped_base))
+            if keep < len(positions):
+                with open(self._segment_path(base), "r+b") as file:
+                    file.truncate(positions[keep])
+                    os.fsync(file.fileno())
+            self.active_positions = positions[:keep]
+            self.positions[base] = self.active_positions
+            self.next_offset = offset
+            self.active = open(self._segment_path(base), "ab")
+
+    def reset(self, next_offset):
+        """
+        Discard the whole log and continue numbering from next_offset.
+
+        Used when a snapshot replaces the log, e.g. on a follower installing one.
+
+        Args:
+            next_offset (int): The offset the next append will get.
+        """
+        with self.lock:
+            self.active.close()
+            for base in self.bases:
+                if os.path.exists(self._segment_path(base)):
+                    os.remove(self._segment_path(base))
+            self.bases = [next_offset]
+            self.active_positions = []
+            self.positions = {next_offset: self.active_positions}
+            self.next_offset = next_offset
+            self.unsynced = False
+            self.active = open(self._segment_path(next_offset), "ab")
+
+    def enforce_retention(self, max_bytes):
+        """
+        Delete the oldest sealed segments until the log fits in max_bytes.
+
+        Args:
+            max_bytes (int): Upper bound on the on-disk size of the log.
+        """
+        with self.lock:
+            while len(self.bases) > 1 and self.size_bytes() > max_bytes:
+                self.truncate_prefix(self.bases[1] - 1)
+
+    def size_bytes(self):
+        """
+        Returns:
+            int: Total size of all segment files on disk.
+        """
+        with self.lock:
+            return sum(os.path.getsize(self._segment_path(base)) for base in self.bases if os.path.exists(self._segment_path(base)))
+
+    def close(self):
+        self.sync()
+        with self.lock:
+            self.active.close()
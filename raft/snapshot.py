@@ -0,0 +1,71 @@
+import json
+import os
+
+
+class SnapshotStore:
+    """
+    Directory of state machine snapshots.
+
+    Each snapshot records the metadata document together with the index and
+    term of the last log entry it covers. Files are written to a temporary
+    name and renamed into place, so a crash never leaves a half-written
+    snapshot as the latest one.
+    """
+
+    def __init__(self, directory, retain=2):
+        """
+        Args:
+            directory (str): Directory holding the snapshot files.
+            retain (int): Number of most recent snapshots kept on disk.
+        """
+        self.directory = directory
+        self.retain = retain
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, index):
+        return os.path.join(self.directory, f"snapshot-{index:020d}.json")
+
+    def _indexes(self):
+        return sorted(
+            int(name[len("snapshot-"):-len(".json")])
+            for name in os.listdir(self.directory)
+            if name.startswith("snapshot-") and name.endswith(".json")
+        )
+
+    def save(self, metadata, last_included_index, last_included_term):
+        """
+        Write a snapshot and drop the ones beyond the retention count.
+
+        Args:
+            metadata (dict): The state machine in the metadata.json layout.
+            last_included_index (int): Index of the last log entry reflected in metadata.
+            last_included_term (int): Term of that entry.
+        """
+        snapshot = {
+            "last_included_index": last_included_index,
+            "last_included_term": last_included_term,
+            "metadata": metadata,
+        }
+        path = self._path(last_included_index)
+        with open(path + ".tmp", "w") as file:
+            json.dump(snapshot, file, separators=(",", ":"))
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(path + ".tmp", path)
+        for index in self._indexes()[:-self.retain]:
+            os.remove(self._path(index))
+
+    def latest(self):
+        """
+        Load the most recent readable snapshot.
+
+        Returns:
+            dict: The snapshot, or None if there is none.
+        """
+        for index in reversed(self._indexes()):
+            try:
+                with open(self._path(index), "r") as file:
+                    return json.load(file)
+            except (OSError, json.JSONDecodeError):
+                print(f"Skipping unreadable snapshot {self._path(index)}")
+        return None
@@ -0,0 +1,94 @@
+import asyncio
+import json
+
+from metadata_store import BATCH, NO_OP, expand_entry
+
+
+def format_event(event_id, event_type, data):
+    """
+    Encode one server-sent event.
+
+    Args:
+        event_id (int or str): The log index, or "index.position" for a record of a batch,
+            sent back by reconnecting clients as Last-Event-ID.
+        event_type (str): The event name, e.g. "TopicRecord".
+        data: A JSON-serialisable payload.
+
+    Returns:
+        str: The event in text/event-stream framing.
+    """
+    return f"id: {event_id}\nevent: {event_type}\ndata: {json.dumps(data, separators=(',', ':'))}\n\n"
+
+
+def entry_events(entry, after=-1):
+    """
+    Encode a committed log entry as one event per metadata record it holds.
+
+    The records of a batch share its log index, so their ids also carry their
+    position in the batch. A client cut off partway through a batch resumes
+    after the last record it received instead of skipping the rest.
+
+    Args:
+        entry (dict): A log entry.
+        after (int): Position in the batch of the last record the client already has, -1 for none.
+
+    Returns:
+        list: The entry's events in text/event-stream framing; none for a no-op entry.
+    """
+    if entry["type"] == NO_OP:
+        return []
+    if entry["type"] != BATCH:
+        return [format_event(entry["index"], entry["type"], entry)]
+    return [
+        format_event(f"{entry['index']}.{position}", record["type"], record)
+        for position, record in enumerate(expand_entry(entry))
+        if position > after
+    ]
+
+
+class Subscriber:
+    """
+    Bounded buffer of applied log entries for one stream client.
+
+    Entries are published from the event loop as they are applied, whole, so a
+    batch is never cut in two by the bound. A client that falls more than
+    max_buffered entries behind is closed instead of letting its buffer grow,
+    and can resume from its last event id.
+    """
+
+    def __init__(self, max_buffered):
+        """
+        Args:
+            max_buffered (int): Upper bound on entries waiting to be sent to the client.
+        """
+        self.queue = asyncio.Queue(max_buffered)
+        # Why the stream ends, or None while it is open
+        self.closed = None
+
+    def publish(self, entries):
+        """
+        Buffer applied entries for the client. Must run on the event loop.
+
+        Args:
+            entries (list): Log entries in index order.
+        """
+        for entry in entries:
+            if self.closed is not None:
+                return
+            try:
+                self.queue.put_nowait(entry)
+            except asyncio.QueueFull:
+                self.close("Subscriber fell too far behind")
+
+    def close(self, reason):
+        """
+        End the stream; the client resumes from its last event id. Must run on the event loop.
+
+        Args:
+            reason (str): Sent to the client in a final "error" event.
+        """
+        if self.closed is None:
+            self.closed = reason
+            # Wake a consumer waiting on an empty buffer
+            if not self.queue.full():
+                self.queue.put_nowait(None)
@@ -1,16 +1,17 @@
 import os
 import json
 import random
-import requests
 import time
 import sys
 import threading
 import uuid
 from fastapi import FastAPI, BackgroundTasks
 from pydantic import BaseModel
-from datetime import datetime, timedelta
+from datetime import datetime
 from schema import *
 from utils import *
+from rpc import PeerPool, RPCError
+from failure_detector import PhiAccrualDetector
 
 app = FastAPI()
 
@@ -19,13 +20,17 @@ class Node:
     def __init__(self, port,leader):
         self.port = port
         self.last_heartbeat_time = None
-        self.timeout = 5
+        # Set by every heartbeat, so the monitor sleeps until one arrives or the timeout passes
+        self.heartbeat_received = threading.Event()
         self.heartbeat_interval = 2
         self.current_term = 0
         self.config = self.read_config("config.json")
+        # Learns the leader's heartbeat intervals; the leader is declared dead once phi reaches the threshold
+        self.detector = PhiAccrualDetector(self.config.get("phi_threshold", 8.0), first_interval=self.heartbeat_interval)
         self.leader = leader
         self.candidate = False
         self.random_shutdown_delay = 0
+        self.peers = PeerPool()
         self.create_node_files()
         self.registered = False
         threading.Thread(target=self.node_task, daemon=True).start()
@@ -167,10 +172,10 @@ class Node:
         """
         metadata = self.read_file(f"{self.port}/metadata.json")
         try:
-            response = requests.post(f"http://localhost:{follower_port}/heartbeat", json=metadata)
+            response = self.peers.get(follower_port).post("/heartbeat", json=metadata)
             print(f"Heartbeat acknowledged by follower on port {follower_port}: {response.json()}")
             self.update_eventlog("sent", follower_port)
-        except requests.RequestException:
+        except RPCError:
             print(f"Failed to send heartbeat to follower on port {follower_port}")
     
 
@@ -197,21 +202,24 @@ class Node:
         Args:
             leader_port (int): The port of the leader node.
         """
-        url = f"http://localhost:{leader_port}/register_follower"
-        response = requests.post(url, json={"follower_port": self.port})
+        try:
+            response = self.peers.get(leader_port).post("/register_follower", json={"follower_port": self.port})
+        except RPCError:
+            print(f"Failed to reach leader on port {leader_port} for registration")
+            return
         if response.status_code != 200:
             print(f"Error registering with leader: {response.content}")
 
     def send_voteRequest(self,follower_port,leader_port):
         try:
-            response = requests.get(f"http://localhost:{follower_port}/vote/{leader_port}")
+            response = self.peers.get(follower_port).get(f"/vote/{leader_port}")
             if(response.text=='"Voted"'):
                 print(f"Vote acknowledged!!! New Leader - {leader_port}")
             else:
                 print(f"Restart Election!!!")
                 self.candidate = False
             # self.update_eventlog("sent", follower_port)
-        except requests.RequestException:
+        except RPCError:
             print(f"Failed to send vote to follower on port {follower_port}")
 
     def monitor_heartbeat(self):
@@ -219,8 +227,10 @@ class Node:
         Monitor the leader's heartbeat and check for leader failure.
         """
         while self.leader!=self.port:
-            time.sleep(1)
-            if self.last_heartbeat_time and datetime.now() - self.last_heartbeat_time > timedelta(seconds=self.timeout):
+            if self.heartbeat_received.wait(self.detector.timeout()):
+                self.heartbeat_received.clear()
+                continue
+            if self.last_heartbeat_time:
                 print("Leader is dead")
                 self.leader = 0
                 break
@@ -231,10 +241,7 @@ class Node:
         self.random_shutdown_delay = random.randint(1, 10)  # Generate a random delay between 1 to 10 seconds
         # self.random_shutdown_delay = 5
         print(f"Becoming Candidate in {self.random_shutdown_delay} seconds...")
-        # time.sleep(random_shutdown_delay)  # Sleep for the random delay
-        start_time = time.time()
-        while(time.time() - start_time <= self.random_shutdown_delay):
-            pass
+        time.sleep(self.random_shutdown_delay)  # Sleep for the random delay
 
         self.config = self.read_config("config.json")
 
@@ -339,6 +346,8 @@ def heartbeat(metadata: dict):
     if node.port!=node.leader:
         with threading.Lock():
             node.last_heartbeat_time = datetime.now()
+            node.detector.heartbeat()
+            node.heartbeat_received.set()
             node.create_or_update_file(f"{node.port}/metadata.json", metadata)
             node.update_eventlog("received", node.port)
     return {"message": "Acknowledged"}
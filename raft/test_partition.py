@@ -0,0 +1,41 @@
+import signal
+import time
+
+import httpx
+
+from bench import *
+
+
+def statuses():
+    return {port: node_status(port) for port in CLUSTER_PORTS}
+
+
+def test_partitioned_follower_does_not_depose_leader(tmp_path):
+    # Pre-vote is on by default; a follower cut off past its election timeout
+    # must rejoin without a new election
+    processes = start_cluster(str(tmp_path), {})
+    leader, victim = CLUSTER_PORTS[0], processes[-1]
+    try:
+        term = node_status(leader)["term"]
+        assert node_status(leader)["role"] == "leader"
+        victim.send_signal(signal.SIGSTOP)
+        try:
+            # Well past election_timeout_max, with writes committed by the remaining majority
+            for name in ("a", "b", "c"):
+                response = httpx.post(f"http://localhost:{leader}/register_topic/", json={"name": name}, timeout=5).json()
+                assert "message" not in response
+            time.sleep(1.0)
+        finally:
+            victim.send_signal(signal.SIGCONT)
+        commit_index = node_status(leader)["commit_index"]
+        deadline = time.monotonic() + 3
+        while time.monotonic() < deadline:
+            for port, status in statuses().items():
+                assert status is None or status["term"] == term, status
+                assert status is None or status["leader"] in (leader, None), status
+            time.sleep(0.05)
+        final = statuses()
+        assert final[leader]["role"] == "leader"
+        assert final[CLUSTER_PORTS[-1]]["commit_index"] >= commit_index
+    finally:
+        stop_cluster(processes)
@@ -0,0 +1,36 @@
+from segment_log import *
+
+
+def fill(directory, count=30):
+    log = SegmentLog(str(directory), segment_bytes=100, fsync_policy=FSYNC_NEVER)
+    for value in range(1, count + 1):
+        log.append({"value": value})
+    return log
+
+
+def values(log):
+    return [record["value"] for record in log.read(log.first_offset)]
+
+
+def test_truncate_suffix_inside_segment(tmp_path):
+    log = fill(tmp_path)
+    offset = log.bases[2] + 1
+    log.truncate_suffix(offset)
+    assert log.last_offset == offset - 1
+    assert values(log) == list(range(1, offset))
+    assert log.append({"value": offset}) == offset
+    assert values(SegmentLog(str(tmp_path))) == list(range(1, offset + 1))
+
+
+def test_truncate_suffix_at_segment_boundary(tmp_path):
+    log = fill(tmp_path)
+    offset = log.bases[2]
+    log.truncate_suffix(offset)
+    assert log.bases[-1] < offset
+    assert log.last_offset == offset - 1
+    assert values(log) == list(range(1, offset))
+    # The previous segment is kept whole and takes the next appends
+    assert log.append({"value": offset}) == offset
+    assert log.append({"value": offset + 1}) == offset + 1
+    assert values(log) == list(range(1, offset + 2))
+    assert values(SegmentLog(str(tmp_path))) == list(range(1, offset + 2))
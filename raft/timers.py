@@ -0,0 +1,64 @@
+import threading
+
+
+class Timer:
+    """
+    One-shot timer on the event loop whose deadline can be moved from any thread.
+
+    The timer is a single loop.call_at handle, so a node with nothing to do
+    sleeps in the event loop's selector instead of polling. Resetting a timer
+    that is already armed only stores the new deadline: when the handle comes
+    due it finds the deadline moved and arms itself again for the rest, so
+    the frequent resets from AppendEntries never wake the loop. The callback
+    runs on the event loop and must not block.
+    """
+
+    def __init__(self, loop, callback):
+        """
+        Args:
+            loop (asyncio.AbstractEventLoop): The event loop that runs the timer.
+            callback (callable): Called without arguments when the timer fires.
+        """
+        self.loop = loop
+        self.callback = callback
+        # Loop time at which the timer fires, or None while it is stopped
+        self.deadline = None
+        self.handle = None
+        self.lock = threading.Lock()
+
+    def reset(self, delay):
+        """
+        Fire the timer delay seconds from now instead of at any earlier deadline. Safe to call from any thread.
+
+        Args:
+            delay (float): Seconds until the callback runs.
+        """
+        with self.lock:
+            self.deadline = self.loop.time() + delay
+            armed = self.handle is not None
+        if not armed:
+            self.loop.call_soon_threadsafe(self.arm)
+
+    def cancel(self):
+        """
+        Stop the timer. Safe to call from any thread; an armed handle runs out without calling back.
+        """
+        with self.lock:
+            self.deadline = None
+
+    def arm(self):
+        with self.lock:
+            if self.handle is None and self.deadline is not None:
+                self.handle = self.loop.call_at(self.deadline, self.expire)
+
+    def expire(self):
+        with self.lock:
+            self.handle = None
+            if self.deadline is None:
+                return
+            if self.deadline > self.loop.time():
+                # Reset while armed: sleep until the new deadline
+                self.handle = self.loop.call_at(self.deadline, self.expire)
+                return
+            self.deadline = None
+        self.callback()
@@ -1,4 +1,7 @@
+import asyncio
+import collections
 import json
+import os
 
 
 def load_data(path):
@@ -32,8 +35,12 @@ def load_data(path):
         return data
 
 def save_data(path,data):
-    with open(path, 'w') as file:
+    # Write a temporary file and rename it over the old one, so a concurrent
+    # load_data sees either the old or the new content, never a partial file
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w') as file:
         json.dump(data, file, indent=2)
+    os.replace(tmp_path, path)
 
 def checkBrokerExists(brokerData,data):
     found_dict = next((broker for broker in data if broker.get("brokerId") == brokerData['brokerId']), None)
@@ -41,4 +48,51 @@ def checkBrokerExists(brokerData,data):
 
 def checkProducerExists(brokerData,data):
     found_dict = next((broker for broker in data if broker.get("producerId") == brokerData['producerId'] and broker.get("brokerId")==brokerData["brokerId"]), None)
-    return found_dict
\ No newline at end of file
+    return found_dict
+
+class LoopLagMonitor:
+    """
+    Measures event loop lag: how much later than scheduled the loop wakes a task
+    sleeping at a fixed interval. Blocking work on the loop, such as synchronous
+    disk access in an async handler, shows up directly as lag.
+    """
+
+    def __init__(self, interval=0.1, window=600):
+        """
+        Args:
+            interval (float): Seconds between samples.
+            window (int): Number of recent samples kept for the statistics.
+        """
+        self.interval = interval
+        self.samples = collections.deque(maxlen=window)
+        self.task = None
+
+    def start(self):
+        """
+        Start sampling. Must run on the event loop being measured.
+        """
+        if self.task is None:
+            self.task = asyncio.ensure_future(self.run())
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            expected = loop.time() + self.interval
+            await asyncio.sleep(self.interval)
+            self.samples.append(max(0.0, loop.time() - expected))
+
+    def stats(self):
+        """
+        Returns:
+            dict: Sample count and last, mean, p99 and max lag in milliseconds over the window.
+        """
+        samples = sorted(self.samples)
+        if not samples:
+            return {"samples": 0}
+        return {
+            "samples": len(samples),
+            "last_ms": round(self.samples[-1] * 1000, 3),
+            "mean_ms": round(sum(samples) / len(samples) * 1000, 3),
+            "p99_ms": round(samples[int(len(samples) * 0.99)] * 1000, 3),
+            "max_ms": round(samples[-1] * 1000, 3),
+        }